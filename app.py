@@ -3,54 +3,150 @@ Main Flask Application
 Refactored to use modular media processor components
 """
 
+import contextlib
 import logging
 import os
-import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
 from flask import Flask, render_template, request, jsonify, send_from_directory, session, redirect
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 
-from config import MAX_CONTENT_LENGTH, get_last_registry_path, save_last_registry_path
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+from config import (
+    DEBUG, MAX_CONTENT_LENGTH, MAX_TRACKED_UPLOAD_JOBS, SECRET_KEY, UPLOAD_WORKERS, USE_X_SENDFILE,
+    get_last_registry_path, save_last_registry_path
+)
+from media_processor.config import LEGACY_HASH_ALGORITHM
 from media_processor.registry import MediaRegistry
-from media_processor.media_processor import MediaProcessor
-from tagging.tag_registry import TagRegistry
+
+if TYPE_CHECKING:
+    from media_processor.media_processor import MediaProcessor
+    from tagging.tag_registry import TagRegistry
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes responses with orjson instead of the stdlib encoder"""
+    
+    def response(self, *args, **kwargs):
+        """Serialize the data straight to bytes, keeping Flask's key sorting and debug indentation"""
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        # Same rules as jsonify: one argument as is, several as a list, keywords as a dict
+        obj = args[0] if len(args) == 1 else (args or kwargs or None)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=option),
+                                        mimetype=self.mimetype)
+
+
 # Initialize Flask app
 app = Flask(__name__)
+if ORJSON_AVAILABLE:
+    app.json = ORJSONProvider(app)
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
-app.secret_key = 'your-secret-key-here'  # Required for sessions
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
+app.secret_key = SECRET_KEY  # Required for sessions
 
 # Global state management
+@dataclass(frozen=True)
+class RegistryBundle:
+    """Components bound to a single registry path, swapped together as one unit"""
+    registry_path: str
+    registry: MediaRegistry
+    
+    @classmethod
+    def for_path(cls, registry_path: str) -> 'RegistryBundle':
+        """Build the registry components for the given registry path"""
+        return cls(registry_path=registry_path, registry=MediaRegistry(registry_path))
+    
+    # The processors are built (and their media/YAML libraries imported) on first use.
+    # They hold no mutable state, so a rare duplicate build from a concurrent first
+    # request is harmless.
+    @cached_property
+    def media_processor(self) -> 'MediaProcessor':
+        from media_processor.media_processor import MediaProcessor
+        return MediaProcessor(self.registry_path)
+    
+    @cached_property
+    def tag_registry(self) -> 'TagRegistry':
+        from tagging.tag_registry import TagRegistry
+        return TagRegistry.get(self.registry_path)
+
+
 class AppState:
     """Manages global application state"""
     def __init__(self):
         # Use persistent registry path on startup
         initial_registry_path = get_last_registry_path()
-        self.current_registry_path = initial_registry_path
-        self.registry = MediaRegistry(initial_registry_path)
-        self.media_processor = MediaProcessor(initial_registry_path)
-        self.tag_registry = TagRegistry(initial_registry_path)
+        self._bundle = RegistryBundle.for_path(initial_registry_path)
+        # Serializes registry switches when running under a threaded server
+        self._lock = threading.Lock()
         logger.info(f"Initialized with registry: {initial_registry_path}")
     
+    @property
+    def bundle(self) -> RegistryBundle:
+        """The current registry components; read once per request so they all belong to one registry"""
+        return self._bundle
+    
+    @property
+    def current_registry_path(self) -> str:
+        return self._bundle.registry_path
+    
+    @property
+    def registry(self) -> MediaRegistry:
+        return self._bundle.registry
+    
+    @property
+    def media_processor(self) -> 'MediaProcessor':
+        return self._bundle.media_processor
+    
+    @property
+    def tag_registry(self) -> 'TagRegistry':
+        return self._bundle.tag_registry
+    
     def update_registry(self, registry_path: str):
         """Update the registry and media processor to use a new registry path"""
-        self.current_registry_path = registry_path
-        self.registry = MediaRegistry(registry_path)
-        self.media_processor = MediaProcessor(registry_path)
-        self.tag_registry = TagRegistry(registry_path)
-        logger.info(f"Updated registry to: {registry_path}")
-        
-        # Save the registry path for persistence
-        if save_last_registry_path(registry_path):
-            logger.info(f"Saved registry path for persistence: {registry_path}")
-        else:
-            logger.warning(f"Failed to save registry path for persistence: {registry_path}")
+        # Build the new components first, then publish them with a single assignment
+        # so concurrent requests never see a mix of old and new components
+        bundle = RegistryBundle.for_path(registry_path)
+        with self._lock:
+            self._bundle = bundle
+            logger.info(f"Updated registry to: {registry_path}")
+            
+            # Save the registry path for persistence
+            if save_last_registry_path(registry_path):
+                logger.info(f"Saved registry path for persistence: {registry_path}")
+            else:
+                logger.warning(f"Failed to save registry path for persistence: {registry_path}")
 
 # Initialize global state
 app_state = AppState()
 
+# Background upload processing, keyed by job id
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload')
+upload_jobs: 'OrderedDict[str, Future]' = OrderedDict()
+upload_jobs_lock = threading.Lock()
+
+# Rendered HTML of pages without per-request context, keyed by template name
+static_pages: Dict[str, str] = {}
+
 
 @app.route('/')
 def index():
@@ -58,47 +154,67 @@ def index():
     return redirect('/upload')
 
 
-@app.route('/upload')
+def render_static_page(template_name: str) -> str:
+    """Render a page that has no per-request context once and reuse the HTML"""
+    # Pages depend only on their own endpoint, so the output only changes when the template does
+    if app.jinja_env.auto_reload:
+        return render_template(template_name)
+    html = static_pages.get(template_name)
+    if html is None:
+        html = static_pages[template_name] = render_template(template_name)
+    return html
+
+
+# Page routes only ever answer GET, so skip Flask's automatic OPTIONS handling
+page_route_options = {'methods': ['GET'], 'provide_automatic_options': False, 'strict_slashes': False}
+
+
+@app.route('/upload', **page_route_options)
 def upload_page():
     """Upload page"""
-    return render_template('upload.html')
+    return render_static_page('upload.html')
 
 
-@app.route('/preview')
+@app.route('/preview', **page_route_options)
 def preview_page():
     """Preview page"""
-    media_count = app_state.registry.get_media_count()
+    media_count = app_state.bundle.registry.get_media_count()
     return render_template('preview.html', media_count=media_count)
 
 
-@app.route('/tag-manager')
+@app.route('/tag-manager', **page_route_options)
 def tag_manager_page():
     """Tag Manager page"""
-    return render_template('tag_manager.html')
+    return render_static_page('tag_manager.html')
 
 
-@app.route('/tag-by-image')
+@app.route('/tag-by-image', **page_route_options)
 def tag_by_image_page():
     """Tag By Image page"""
-    return render_template('tag_by_image.html')
+    return render_static_page('tag_by_image.html')
 
 
-@app.route('/tag-by-tag')
+@app.route('/tag-by-tag', **page_route_options)
 def tag_by_tag_page():
     """Tag By Tag page"""
-    return render_template('tag_by_tag.html')
+    return render_static_page('tag_by_tag.html')
+
+
+def registry_info(registry: MediaRegistry) -> dict:
+    """Describe a registry for the registry API responses"""
+    return {
+        'path': registry.get_registry_path(),
+        'directory': registry.get_registry_directory(),
+        'name': registry.get_registry_name(),
+        'display_name': registry.get_display_name(),
+        'media_count': registry.get_media_count()
+    }
 
 
 @app.route('/api/registry/current')
 def get_current_registry():
     """Get information about the current registry"""
-    return jsonify({
-        'path': app_state.registry.get_registry_path(),
-        'directory': app_state.registry.get_registry_directory(),
-        'name': app_state.registry.get_registry_name(),
-        'display_name': app_state.registry.get_display_name(),
-        'media_count': app_state.registry.get_media_count()
-    })
+    return jsonify(registry_info(app_state.bundle.registry))
 
 
 @app.route('/api/registry/switch', methods=['POST'])
@@ -123,102 +239,190 @@ def switch_registry():
         
         return jsonify({
             'success': True,
-            'registry_info': {
-                'path': app_state.registry.get_registry_path(),
-                'directory': app_state.registry.get_registry_directory(),
-                'name': app_state.registry.get_registry_name(),
-                'display_name': app_state.registry.get_display_name(),
-                'media_count': app_state.registry.get_media_count()
-            }
+            'registry_info': registry_info(app_state.bundle.registry)
         })
     except Exception as e:
         logger.error(f"Failed to switch registry: {e}")
         return jsonify({'error': f'Failed to switch registry: {str(e)}'}), 500
 
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    """Handle file upload"""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    # Save uploaded file temporarily
-    temp_path = os.path.join(tempfile.gettempdir(), secure_filename(file.filename))
-    file.save(temp_path)
+def find_duplicate_upload(registry: MediaRegistry, file_hash: str, legacy_hash: Optional[str] = None):
+    """Find an existing entry for an upload, migrating a matching legacy hash if needed"""
+    duplicate_entry, duplicate_index = registry.find_duplicate_with_index(file_hash)
+    if duplicate_entry or not legacy_hash:
+        return duplicate_entry, duplicate_index
     
+    # Store the current hash on a legacy match so the entry matches directly next time
+    return registry.migrate_legacy_hash(legacy_hash, file_hash)
+
+
+def process_upload(registry: MediaRegistry, media_processor: 'MediaProcessor',
+                   filename: str, temp_path: str, file_hash: str,
+                   legacy_hash: Optional[str] = None) -> Tuple[Dict[str, Any], int]:
+    """Run the duplicate check, conversion and registry write for a saved upload"""
+    relative_path = None
     try:
-        # Calculate hash of uploaded file for duplicate detection
-        file_hash = app_state.media_processor.get_file_hash(temp_path)
-        
         # Check for duplicates
-        duplicate_entry = app_state.registry.find_duplicate_by_hash(file_hash)
+        duplicate_entry, duplicate_index = find_duplicate_upload(registry, file_hash, legacy_hash)
         
         if duplicate_entry:
-            # This is a duplicate file - skip processing entirely
-            return jsonify({
+            # This is a duplicate file - discard the upload and skip processing entirely
+            logger.info(f"Skipped duplicate upload: {filename}")
+            return {
                 'success': False,
                 'is_duplicate': True,
                 'duplicate_info': {
                     'path': duplicate_entry['path'],
-                    'index': app_state.registry.get_all_media().index(duplicate_entry)
+                    'index': duplicate_index
                 },
-                'message': f'Duplicate file detected: {file.filename}'
-            }), 409  # 409 Conflict
+                'message': f'Duplicate file detected: {filename}'
+            }, 409  # 409 Conflict
         
         # Process the file (pass registry for filename collision handling)
-        relative_path, error = app_state.media_processor.process_media_file(temp_path, app_state.registry)
+        relative_path, error = media_processor.process_media_file(temp_path, registry, secure_filename(filename))
         
         if error:
-            logger.error(f"Failed to process file {file.filename}: {error}")
-            return jsonify({'error': error}), 400
+            logger.error(f"Failed to process file {filename}: {error}")
+            return {'error': error}, 400
         
         # Add to registry with hash
-        if app_state.registry.add_media(relative_path, file_hash):
-            logger.info(f"Successfully processed and added to registry: {file.filename}")
-            return jsonify({
+        if registry.add_media(relative_path, file_hash):
+            logger.info(f"Successfully processed and added to registry: {filename}")
+            return {
                 'success': True,
                 'path': relative_path,
-                'message': f'Successfully processed {file.filename}'
-            })
+                'message': f'Successfully processed {filename}'
+            }, 200
         else:
-            logger.error(f"Failed to save {file.filename} to registry")
-            return jsonify({'error': 'Failed to save to registry'}), 500
+            logger.error(f"Failed to save {filename} to registry")
+            return {'error': 'Failed to save to registry'}, 500
         
     except Exception as e:
-        logger.error(f"Unexpected error processing {file.filename}: {e}")
-        return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+        logger.error(f"Unexpected error processing {filename}: {e}")
+        return {'error': f'Unexpected error: {str(e)}'}, 500
     finally:
-        # Clean up temp file
-        if os.path.exists(temp_path):
+        # Remove the partial upload; the processed copy lives under its own name
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        # Free the output name if it never reached the registry (a no-op once add_media took it)
+        if relative_path:
+            registry.release_filename(relative_path.rpartition('/')[2])
+
+
+def submit_upload_job(bundle: RegistryBundle, filename: str, temp_path: str, file_hash: str,
+                      legacy_hash: Optional[str] = None) -> str:
+    """Queue a saved upload for background processing and return its job id"""
+    job_id = uuid.uuid4().hex
+    # Bind the request's registry components so a registry switch can't split the job
+    future = upload_executor.submit(
+        process_upload, bundle.registry, bundle.media_processor, filename, temp_path, file_hash, legacy_hash
+    )
+    with upload_jobs_lock:
+        upload_jobs[job_id] = future
+        # Forget the oldest finished jobs once too many are being tracked
+        while len(upload_jobs) > MAX_TRACKED_UPLOAD_JOBS:
+            oldest_id, oldest_future = next(iter(upload_jobs.items()))
+            if not oldest_future.done():
+                break
+            del upload_jobs[oldest_id]
+    return job_id
+
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    """Handle file upload"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    # Read the components once so a concurrent registry switch can't split the upload between registries
+    bundle = app_state.bundle
+    
+    # Stream the upload into the media folder, hashing it for duplicate detection as it is written
+    temp_path = bundle.media_processor.create_upload_path(secure_filename(file.filename))
+    
+    # Older entries were hashed with the legacy algorithm, so also compute that digest while some remain
+    legacy_algorithm = LEGACY_HASH_ALGORITHM if bundle.registry.has_legacy_hashes() else None
+    
+    try:
+        file_hash, legacy_hash = bundle.media_processor.save_upload(file.stream, temp_path, legacy_algorithm)
+    except Exception as e:
+        logger.error(f"Unexpected error saving {file.filename}: {e}")
+        with contextlib.suppress(FileNotFoundError):
             os.remove(temp_path)
+        return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+    
+    if request.values.get('background') in ('1', 'true'):
+        # Hand processing to a worker and let the client poll for the result
+        job_id = submit_upload_job(bundle, file.filename, temp_path, file_hash, legacy_hash)
+        return jsonify({'job_id': job_id, 'status': 'processing'}), 202
+    
+    result, status_code = process_upload(
+        bundle.registry, bundle.media_processor, file.filename, temp_path, file_hash, legacy_hash
+    )
+    return jsonify(result), status_code
+
+
+@app.route('/api/jobs/<job_id>')
+def get_upload_job(job_id):
+    """Get the status of a background upload job"""
+    with upload_jobs_lock:
+        future = upload_jobs.get(job_id)
+    
+    if future is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if not future.done():
+        return jsonify({'job_id': job_id, 'status': 'processing'})
+    
+    # Report the finished job the same way a synchronous upload would have
+    result, status_code = future.result()
+    return jsonify({**result, 'job_id': job_id, 'status': 'done'}), status_code
+
+
+def registry_json_response(registry: MediaRegistry, get_data: Callable[[], Any]):
+    """Respond with data read from the registry, or 304 if the client's copy is still current"""
+    # Stat before reading so the ETag can never claim a newer version than the data sent
+    etag = registry.get_etag()
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(get_data())
+    if etag:
+        response.set_etag(etag)
+    return response
 
 
 @app.route('/api/media')
 def get_media_list():
     """Get list of all media files"""
-    return jsonify(app_state.registry.get_all_media())
+    registry = app_state.bundle.registry
+    return registry_json_response(registry, registry.get_all_media)
 
 
 @app.route('/api/media/<int:index>')
 def get_media_info(index):
     """Get info about a specific media file by index"""
-    media_info = app_state.registry.get_media_by_index(index)
+    # Read the components once so the entry and its file come from the same registry
+    bundle = app_state.bundle
+    media_info = bundle.registry.get_media_by_index(index)
     if media_info:
         # Get additional file information including dimensions
-        file_path = os.path.join(app_state.media_processor.upload_folder, media_info['path'].split('/')[-1])
-        if os.path.exists(file_path):
-            try:
-                file_info = app_state.media_processor.get_processing_info(file_path)
-                # Merge the registry info with file info
-                media_info.update(file_info)
-            except Exception as e:
-                logger.warning(f"Could not get file info for index {index}: {e}")
-                # If we can't get file info, just continue with basic info
-                pass
+        file_path = bundle.media_processor.get_media_path(media_info['path'])
+        try:
+            file_info = bundle.media_processor.get_cached_processing_info(file_path)
+            # Merge the registry info with file info
+            media_info.update(file_info)
+        except FileNotFoundError:
+            # Media file is missing, just return the registry info
+            pass
+        except Exception as e:
+            logger.warning(f"Could not get file info for index {index}: {e}")
+            # If we can't get file info, just continue with basic info
+            pass
         return jsonify(media_info)
     return jsonify({'error': 'Index out of range'}), 404
 
@@ -226,19 +430,23 @@ def get_media_info(index):
 @app.route('/api/media/<int:index>', methods=['DELETE'])
 def delete_media(index):
     """Delete a media file by index"""
-    media_info = app_state.registry.get_media_by_index(index)
+    # Read the components once so the file and the index are removed from the same registry
+    bundle = app_state.bundle
+    media_info = bundle.registry.get_media_by_index(index)
     if not media_info:
         return jsonify({'error': 'Index out of range'}), 404
     
     try:
         # Remove the file from the media directory
-        file_path = os.path.join(app_state.media_processor.upload_folder, media_info['path'].split('/')[-1])
-        if os.path.exists(file_path):
+        file_path = bundle.media_processor.get_media_path(media_info['path'])
+        try:
             os.remove(file_path)
             logger.info(f"Deleted media file: {file_path}")
+        except FileNotFoundError:
+            logger.warning(f"Media file already missing: {file_path}")
         
         # Remove from registry
-        if app_state.registry.remove_media_by_index(index):
+        if bundle.registry.remove_media_by_index(index):
             return jsonify({'success': True, 'message': 'Media deleted successfully'})
         else:
             logger.error(f"Failed to remove media at index {index} from registry")
@@ -251,18 +459,22 @@ def delete_media(index):
 @app.route('/api/media/count')
 def get_media_count():
     """Get the total number of media files"""
-    return jsonify({'count': app_state.registry.get_media_count()})
+    registry = app_state.bundle.registry
+    return registry_json_response(registry, lambda: {'count': registry.get_media_count()})
 
 
 @app.route('/<folder_name>/<path:filename>')
 def serve_media(folder_name, filename):
     """Serve media files from the current registry's media directory"""
+    # Read the processor once so a concurrent registry switch can't change it mid-request
+    media_processor = app_state.bundle.media_processor
+    
     # Verify that the folder name matches the current upload folder
-    current_folder_name = os.path.basename(app_state.media_processor.upload_folder)
-    if folder_name != current_folder_name:
+    if folder_name != media_processor.upload_folder_name:
         return jsonify({'error': 'Invalid media path'}), 404
     
-    return send_from_directory(app_state.media_processor.upload_folder, filename)
+    # Conditional responses let browsers revalidate cached media with a 304
+    return send_from_directory(media_processor.upload_folder, filename, conditional=True, etag=True)
 
 
 @app.route('/api/tags/config')
@@ -321,4 +533,4 @@ initialize_registry()
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run(debug=DEBUG)
@@ -1,22 +1,64 @@
 """
 Global configuration settings for the Media Management Tool
+Importing this module touches no files; folders are created on first use via ensure_media_folder_exists
 """
 
+import contextlib
 import json
 import logging
 import os
-from typing import Optional
+import secrets
+from typing import Any, Optional
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 # Flask Configuration
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB max file size
+USE_X_SENDFILE = False  # Let a fronting nginx/Apache server send media files (X-Sendfile)
+# Signs session cookies; without SECRET_KEY set, sessions only last until the server restarts
+SECRET_KEY = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
+DEBUG = os.environ.get('FLASK_DEBUG') == '1'  # Reloader and debugger for `python app.py`
+
+# Background Upload Configuration
+UPLOAD_WORKERS = 4  # Threads processing uploads submitted with background=1
+MAX_TRACKED_UPLOAD_JOBS = 1000  # Finished jobs kept for status polling
 
 # Registry Configuration
 DEFAULT_REGISTRY_FILE = 'events_registry.json'
 CONFIG_FILE = '.dmm_config.json'
 
+# Registry path last read from or written to CONFIG_FILE, used to skip redundant writes
+_last_saved_registry_path: Optional[str] = None
+
+
+def loads_json(data: bytes) -> Any:
+    """Parse JSON from bytes, using orjson when it is installed"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_json_file(path: str) -> Any:
+    """Parse a JSON file, using orjson when it is installed"""
+    # Unbuffered, since the file is read in one call and a BufferedReader would only add a copy.
+    # Not memory-mapped: a writer truncating the file mid-parse would kill the process with SIGBUS.
+    with open(path, 'rb', buffering=0) as f:
+        return loads_json(f.read())
+
+
+def dumps_json(obj: Any) -> bytes:
+    """Serialize to indented JSON bytes, using orjson when it is installed"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
 
 def get_last_registry_path() -> str:
     """
@@ -25,24 +67,28 @@ def get_last_registry_path() -> str:
     Returns:
         The last registry path if valid, otherwise DEFAULT_REGISTRY_FILE
     """
+    global _last_saved_registry_path
     try:
-        if not os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, 'rb') as f:
+                config = loads_json(f.read())
+        except FileNotFoundError:
             logger.debug(f"Config file {CONFIG_FILE} not found, using default registry")
             return DEFAULT_REGISTRY_FILE
         
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-        
         registry_path = config.get('last_registry_path')
         if not registry_path:
             logger.warning("No registry path found in config file, using default")
             return DEFAULT_REGISTRY_FILE
         
         # Validate that the registry file exists
-        if not os.path.exists(registry_path):
+        try:
+            os.stat(registry_path)
+        except FileNotFoundError:
             logger.warning(f"Saved registry path {registry_path} does not exist, using default")
             return DEFAULT_REGISTRY_FILE
         
+        _last_saved_registry_path = registry_path
         logger.info(f"Loaded last registry path: {registry_path}")
         return registry_path
         
@@ -61,14 +107,25 @@ def save_last_registry_path(registry_path: str) -> bool:
     Returns:
         True if saved successfully, False otherwise
     """
+    global _last_saved_registry_path
+    if registry_path == _last_saved_registry_path:
+        logger.debug(f"Registry path unchanged, skipping config write: {registry_path}")
+        return True
+    
+    # Write to a temporary file and swap it in so the config is never left half-written
+    temp_file = f'{CONFIG_FILE}.tmp'
     try:
         config = {'last_registry_path': registry_path}
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        with open(temp_file, 'wb') as f:
+            f.write(dumps_json(config))
+        os.replace(temp_file, CONFIG_FILE)
+        _last_saved_registry_path = registry_path
         logger.info(f"Saved registry path to config: {registry_path}")
         return True
     except (IOError, TypeError, ValueError) as e:
         logger.error(f"Error saving registry path to config file: {e}")
+        with contextlib.suppress(OSError):
+            os.remove(temp_file)
         return False
 
 
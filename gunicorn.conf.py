@@ -0,0 +1,17 @@
+"""
+Gunicorn configuration for the Media Management Tool
+Start the server with: gunicorn -c gunicorn.conf.py app:app
+"""
+
+# Server socket
+bind = '127.0.0.1:5000'
+
+# Uploads and media downloads are IO-bound, so a pool of threads serves
+# concurrent clients. The registry JSON file is cached in memory by the
+# process that owns it, so keep a single worker process.
+worker_class = 'gthread'
+workers = 1
+threads = 16
+
+# Video conversion runs inside the upload request and can take a while
+timeout = 300
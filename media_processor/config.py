@@ -4,11 +4,18 @@ Media processing configuration settings
 
 # Supported File Formats
 SUPPORTED_INPUT_FORMATS = {
-    'image': ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'],
-    'video': ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv']
+    'image': frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}),
+    'video': frozenset({'.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv'})
 }
 
-SUPPORTED_OUTPUT_FORMATS = ['.webm', '.png', '.jpg']
+SUPPORTED_OUTPUT_FORMATS = frozenset({'.webm', '.png', '.jpg'})
+
+# Extension -> file type lookup built from SUPPORTED_INPUT_FORMATS
+EXT_TO_TYPE = {
+    ext: file_type
+    for file_type, extensions in SUPPORTED_INPUT_FORMATS.items()
+    for ext in extensions
+}
 
 # Media Processing Settings
 # Landscape media: scale to width = 1024, height calculated proportionally
@@ -21,6 +28,63 @@ SQUARE_TARGET_SIZE = 576
 # Video Processing Settings
 VIDEO_CRF_MP4 = 23
 VIDEO_CRF_WEBM = 30
+# Hardware decoder passed to ffmpeg's -hwaccel (e.g. 'auto', 'cuda', 'vaapi'); None decodes on the CPU.
+# Encoding stays on libvpx-vp9 either way, since NVENC has no VP9 encoder.
+VIDEO_HWACCEL = None
+# Keep decoded frames in GPU memory (e.g. 'cuda' with VIDEO_HWACCEL = 'cuda') so they are scaled there
+# and only the scaled frames are copied back for the encoder; None downloads every frame before scaling.
+VIDEO_HWACCEL_OUTPUT_FORMAT = None
+
+# ffmpeg.input keyword arguments for source videos
+DECODE_PARAMS = {'hwaccel': VIDEO_HWACCEL} if VIDEO_HWACCEL else {}
+if VIDEO_HWACCEL and VIDEO_HWACCEL_OUTPUT_FORMAT:
+    DECODE_PARAMS['hwaccel_output_format'] = VIDEO_HWACCEL_OUTPUT_FORMAT
+
+# Scale filters for frames left on the GPU, keyed by hwaccel_output_format
+HW_SCALE_FILTERS = {'cuda': 'scale_cuda'}
 
 # Image Processing Settings
 JPEG_QUALITY = 95
+# Large downscales first shrink by an integer factor with a fast box filter, keeping the
+# image at least this many times the target size before the Lanczos pass (None disables).
+# 2.0 is also Pillow's default for Image.thumbnail.
+RESIZE_REDUCING_GAP = 2.0
+
+# Encoder options per (file type, output extension), built once at import.
+# Video entries are ffmpeg.output keyword arguments; image entries are PIL save arguments.
+ENCODE_PARAMS = {
+    # row_mt lets libvpx-vp9 encode tile rows on multiple threads instead of mostly one core
+    ('video', '.webm'): {'vcodec': 'libvpx-vp9', 'acodec': 'libopus', 'crf': VIDEO_CRF_WEBM, 'row_mt': 1},
+    # Optimized Huffman tables and progressive scans make smaller files at the same quality
+    ('image', '.jpg'): {'format': 'JPEG', 'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True},
+    ('image', '.png'): {'format': 'PNG'},
+}
+
+
+def get_encode_params(file_type: str, output_ext: str) -> dict:
+    """Return the encoder options for a file type and output extension ({} if none)"""
+    return ENCODE_PARAMS.get((file_type, output_ext), {})
+
+
+# ffprobe codec_name produced by each video encoder, used to spot sources that need no re-encode
+ENCODER_CODEC_NAMES = {'libvpx-vp9': 'vp9'}
+
+# File IO Settings
+FILE_CHUNK_SIZE = 1024 * 1024  # 1MB chunks when streaming and hashing files
+STALE_UPLOAD_AGE = 60 * 60  # Seconds before a leftover .upload-*.partial file counts as abandoned
+UPLOAD_WRITE_QUEUE_CHUNKS = 8  # Chunks hashed ahead of the disk writer while saving an upload
+PROCESSING_INFO_CACHE_SIZE = 4096  # Media files whose dimensions/codec info is kept in memory
+FILE_TYPE_CACHE_SIZE = 4096  # Filenames whose extension and file type are kept in memory
+ANIMATION_PROBE_CACHE_SIZE = 2048  # GIF/WebP files whose animated flag is kept in memory
+DIMENSIONS_CACHE_SIZE = 4096  # Source sizes whose scaled dimensions are kept in memory
+
+# Duplicate Detection Settings
+# BLAKE2b is faster than MD5 on 64-bit CPUs. A 20-byte digest (40 hex characters)
+# keeps new hashes distinguishable from the 32-character MD5 hashes in older registries.
+HASH_ALGORITHM = 'blake2b'
+HASH_DIGEST_SIZE = 20
+LEGACY_HASH_ALGORITHM = 'md5'
+HASH_WORKERS = 4  # Threads used by FileUtils.hash_files (hashlib releases the GIL on large reads)
+
+# Batch Processing Settings
+PROCESSING_WORKERS = 4  # Files converted at once by MediaProcessor.process_media_files
@@ -5,14 +5,23 @@ Handles file type detection, path operations, and file validation
 
 import hashlib
 import logging
-from pathlib import Path
-from typing import Optional, Tuple
-from PIL import Image
-from .config import SUPPORTED_INPUT_FORMATS, SUPPORTED_OUTPUT_FORMATS
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from .config import (EXT_TO_TYPE, SUPPORTED_OUTPUT_FORMATS, FILE_CHUNK_SIZE,
+                     UPLOAD_WRITE_QUEUE_CHUNKS, FILE_TYPE_CACHE_SIZE, ANIMATION_PROBE_CACHE_SIZE,
+                     DIMENSIONS_CACHE_SIZE, HASH_ALGORITHM, HASH_DIGEST_SIZE, HASH_WORKERS,
+                     LANDSCAPE_TARGET_WIDTH, PORTRAIT_TARGET_HEIGHT, SQUARE_TARGET_SIZE)
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Units used by format_file_size, each 1024 times the previous
+SIZE_UNITS = ("B", "KB", "MB", "GB")
+
 
 class FileUtils:
     """Utility functions for file operations"""
@@ -21,9 +30,9 @@ class FileUtils:
     def is_animated_gif(file_path: str) -> bool:
         """Check if a GIF file is animated"""
         try:
-            with Image.open(file_path) as img:
-                # Check if the image has multiple frames
-                return hasattr(img, 'n_frames') and img.n_frames > 1
+            stat = os.stat(file_path)
+            # Check if the image has multiple frames (cached per file version)
+            return _is_animated_image(file_path, stat.st_mtime_ns, stat.st_size)
         except Exception as e:
             logger.warning(f"Error checking if GIF is animated: {e}")
             return False
@@ -32,17 +41,34 @@ class FileUtils:
     def is_animated_webp(file_path: str) -> bool:
         """Check if a WebP file is animated"""
         try:
-            with Image.open(file_path) as img:
-                # Use PIL's built-in is_animated property
-                return img.is_animated
+            stat = os.stat(file_path)
+            # Use PIL's built-in is_animated property (cached per file version)
+            return _is_animated_image(file_path, stat.st_mtime_ns, stat.st_size)
         except Exception as e:
             logger.warning(f"Error checking if WebP is animated: {e}")
             return False
     
+    @staticmethod
+    def classify(filename: str, file_path: str = None) -> Tuple[Optional[str], Optional[str]]:
+        """Determine both the file type and output format, checking animation at most once"""
+        ext, file_type = _classify_extension(filename)
+        
+        # GIF and WebP files are videos if animated, otherwise images converted to PNG
+        if ext in ('.gif', '.webp') and file_path:
+            if ext == '.gif':
+                is_animated = FileUtils.is_animated_gif(file_path)
+            else:
+                is_animated = FileUtils.is_animated_webp(file_path)
+            return ('video', '.webm') if is_animated else ('image', '.png')
+        
+        if not file_type:
+            return None, None
+        return file_type, FileUtils.get_output_format(filename, file_type)
+    
     @staticmethod
     def get_file_type(filename: str, file_path: str = None) -> Optional[str]:
         """Determine if file is image or video based on extension and content"""
-        ext = Path(filename).suffix.lower()
+        ext, file_type = _classify_extension(filename)
         
         # Special handling for GIF files
         if ext == '.gif' and file_path:
@@ -61,21 +87,17 @@ class FileUtils:
                 return 'image'  # Static WebPs are treated as images
         
         # Regular file type detection
-        if ext in SUPPORTED_INPUT_FORMATS['image']:
-            return 'image'
-        elif ext in SUPPORTED_INPUT_FORMATS['video']:
-            return 'video'
-        return None
+        return file_type
     
     @staticmethod
     def is_supported_format(filename: str) -> bool:
         """Check if file format is supported"""
-        return FileUtils.get_file_type(filename) is not None
+        return _classify_extension(filename)[1] is not None
     
     @staticmethod
     def get_output_format(filename: str, file_type: str, file_path: str = None) -> str:
         """Determine the appropriate output format for a file"""
-        input_ext = Path(filename).suffix.lower()
+        input_ext = _classify_extension(filename)[0]
         
         # Special handling for GIF files
         if input_ext == '.gif':
@@ -104,32 +126,107 @@ class FileUtils:
     @staticmethod
     def create_output_filename(input_filename: str, output_ext: str) -> str:
         """Create output filename with new extension"""
-        return Path(input_filename).stem + output_ext
+        return os.path.splitext(os.path.basename(input_filename))[0] + output_ext
     
     @staticmethod
-    def calculate_file_hash(file_path: str) -> str:
+    def create_hasher(algorithm: str = HASH_ALGORITHM):
+        """Create a hashlib object for duplicate detection"""
+        if algorithm == 'blake2b':
+            return hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+        return hashlib.new(algorithm)
+    
+    @staticmethod
+    def is_legacy_hash(file_hash: str) -> bool:
+        """Check if a stored hash was made with an older algorithm than HASH_ALGORITHM"""
+        return len(file_hash) != HASH_DIGEST_SIZE * 2
+    
+    @staticmethod
+    def calculate_file_hash(file_path: str, algorithm: str = HASH_ALGORITHM) -> str:
         """Calculate a fast hash of the file content for duplicate detection"""
-        hash_md5 = hashlib.md5()
         try:
             with open(file_path, "rb") as f:
-                # Read file in chunks to handle large files efficiently
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+                if hasattr(hashlib, 'file_digest'):
+                    # Python 3.11+: read into a reused buffer and hash without per-chunk allocations
+                    return hashlib.file_digest(f, lambda: FileUtils.create_hasher(algorithm)).hexdigest()
+                # Read file in large chunks to keep the number of reads and loop iterations low
+                file_hash = FileUtils.create_hasher(algorithm)
+                for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b""):
+                    file_hash.update(chunk)
+                return file_hash.hexdigest()
         except Exception as e:
             logger.error(f"Error calculating hash for {file_path}: {e}")
             return ""
     
+    @staticmethod
+    def hash_files(file_paths: Iterable[str], algorithm: str = HASH_ALGORITHM,
+                   max_workers: int = HASH_WORKERS) -> Dict[str, str]:
+        """Hash many files concurrently, returning {path: hash} ("" for unreadable files)"""
+        file_paths = list(file_paths)
+        if len(file_paths) <= 1 or max_workers <= 1:
+            return {path: FileUtils.calculate_file_hash(path, algorithm) for path in file_paths}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            hashes = executor.map(lambda path: FileUtils.calculate_file_hash(path, algorithm), file_paths)
+            return dict(zip(file_paths, hashes))
+    
+    @staticmethod
+    def save_stream_with_hash(stream, output_path: str, extra_hasher=None) -> str:
+        """Write a binary stream to disk, hashing it in the same pass (extra_hasher is fed every chunk too)"""
+        file_hash = FileUtils.create_hasher()
+        chunks = queue.Queue(maxsize=UPLOAD_WRITE_QUEUE_CHUNKS)
+        write_errors = []
+        
+        def write_chunks(f):
+            # Keep draining after a failure so the reader never blocks on a full queue
+            for chunk in iter(chunks.get, None):
+                if not write_errors:
+                    try:
+                        f.write(chunk)
+                    except OSError as e:
+                        write_errors.append(e)
+        
+        with open(output_path, "wb") as f:
+            # Writes run on their own thread so disk IO overlaps hashing (both release the GIL)
+            writer = threading.Thread(target=write_chunks, args=(f,), daemon=True)
+            writer.start()
+            try:
+                # Hash each chunk as it is read so the file never has to be re-read
+                for chunk in iter(lambda: stream.read(FILE_CHUNK_SIZE), b""):
+                    file_hash.update(chunk)
+                    if extra_hasher is not None:
+                        extra_hasher.update(chunk)
+                    chunks.put(chunk)
+            finally:
+                chunks.put(None)
+                writer.join()
+        
+        if write_errors:
+            raise write_errors[0]
+        return file_hash.hexdigest()
+    
     @staticmethod
     def normalize_path(path: str) -> str:
         """Normalize path to use forward slashes for cross-platform compatibility"""
-        return path.replace('\\', '/')
+        return path if '\\' not in path else path.replace('\\', '/')
     
     @staticmethod
     def get_file_info(file_path: str) -> Tuple[str, str, int]:
         """Get basic file information (name, extension, size)"""
-        path_obj = Path(file_path)
-        return path_obj.name, path_obj.suffix.lower(), path_obj.stat().st_size
+        name = os.path.basename(file_path)
+        return name, _classify_extension(name)[0], os.stat(file_path).st_size
+    
+    @staticmethod
+    def scan_directory(root: str) -> Iterator[Tuple[str, str, str, str, int]]:
+        """Yield (path, name, extension, file type, size) for supported media files in a directory"""
+        with os.scandir(root) as entries:
+            for entry in entries:
+                # DirEntry caches the file type from the directory listing; not following symlinks
+                # keeps both checks free of extra stat calls (symlinks are skipped)
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                ext, file_type = _classify_extension(entry.name)
+                if file_type is None:
+                    continue
+                yield entry.path, entry.name, ext, file_type, entry.stat(follow_symlinks=False).st_size
     
     @staticmethod
     def format_file_size(size_bytes: int) -> str:
@@ -137,15 +234,12 @@ class FileUtils:
         if size_bytes == 0:
             return "0 B"
         
-        size_names = ["B", "KB", "MB", "GB"]
-        i = 0
-        while size_bytes >= 1024 and i < len(size_names) - 1:
-            size_bytes /= 1024.0
-            i += 1
-        
-        return f"{size_bytes:.1f} {size_names[i]}"
+        # Each unit is 2**10 times the last, so the bit length picks the unit directly
+        i = min((int(size_bytes).bit_length() - 1) // 10, len(SIZE_UNITS) - 1)
+        return f"{size_bytes / (1 << (10 * i)):.1f} {SIZE_UNITS[i]}"
     
     @staticmethod
+    @lru_cache(maxsize=DIMENSIONS_CACHE_SIZE)
     def calculate_dimensions(width: int, height: int, ensure_even: bool = False) -> Tuple[int, int]:
         """
         Calculate new dimensions while maintaining aspect ratio.
@@ -158,34 +252,104 @@ class FileUtils:
         Returns:
             Tuple of (new_width, new_height)
         """
-        from .config import LANDSCAPE_TARGET_WIDTH, PORTRAIT_TARGET_HEIGHT, SQUARE_TARGET_SIZE
-        
         # Handle edge cases where dimensions might be 0 or invalid
         if width <= 0 or height <= 0:
             # Default to square dimensions if we can't determine aspect ratio
             new_width = new_height = SQUARE_TARGET_SIZE
+        # Landscape media: scale to width = 1024, height calculated proportionally
+        # Portrait media: scale to height = 576, width calculated proportionally
+        # Square media: scale to width = height = 576
+        # Integer floor division gives the exact truncated size without float rounding
+        elif width > height:
+            new_width = LANDSCAPE_TARGET_WIDTH
+            new_height = LANDSCAPE_TARGET_WIDTH * height // width
+        elif width < height:
+            new_height = PORTRAIT_TARGET_HEIGHT
+            new_width = PORTRAIT_TARGET_HEIGHT * width // height
         else:
-            aspect_ratio = width / height
-            
-            # Landscape media: scale to width = 1024, height calculated proportionally
-            # Portrait media: scale to height = 576, width calculated proportionally
-            # Square media: scale to width = height = 576
-            if aspect_ratio > 1.0:
-                # Landscape - scale to width = 1024
-                new_width = LANDSCAPE_TARGET_WIDTH
-                new_height = int(new_width / aspect_ratio)
-            elif aspect_ratio < 1.0:
-                # Portrait - scale to height = 576
-                new_height = PORTRAIT_TARGET_HEIGHT
-                new_width = int(new_height * aspect_ratio)
-            else:
-                # Square - scale to 576x576
-                new_width = SQUARE_TARGET_SIZE
-                new_height = SQUARE_TARGET_SIZE
+            new_width = new_height = SQUARE_TARGET_SIZE
         
         # Ensure dimensions are even (required for some video codecs)
         if ensure_even:
-            new_width = new_width - (new_width % 2)
-            new_height = new_height - (new_height % 2)
+            new_width &= ~1
+            new_height &= ~1
         
         return new_width, new_height
+
+
+@lru_cache(maxsize=FILE_TYPE_CACHE_SIZE)
+def _classify_extension(filename: str) -> Tuple[str, Optional[str]]:
+    """Get the lowercase extension of a filename and the file type it implies (ignoring animation)"""
+    ext = os.path.splitext(filename)[1].lower()
+    return ext, EXT_TO_TYPE.get(ext)
+
+
+@lru_cache(maxsize=ANIMATION_PROBE_CACHE_SIZE)
+def _is_animated_image(file_path: str, mtime_ns: int, size: int) -> bool:
+    """Whether one version of an image file has multiple frames (mtime and size are part of the cache key)"""
+    with open(file_path, 'rb') as f:
+        is_animated = _read_animation_flag(f)
+    if is_animated is not None:
+        return is_animated
+    
+    # Unrecognized or malformed header - let PIL decide (imported here so the
+    # registry and other PIL-free callers don't load Pillow on startup)
+    from PIL import Image
+    with Image.open(file_path) as img:
+        return getattr(img, 'is_animated', False)
+
+
+def _read_animation_flag(f) -> Optional[bool]:
+    """Read whether a GIF/WebP file is animated from its container structure, or None if unsure"""
+    header = f.read(12)
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        f.seek(6)
+        return _gif_has_multiple_frames(f)
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        # An extended (VP8X) WebP carries an animation flag; simple VP8/VP8L files are single frames
+        chunk = f.read(9)
+        if chunk[:4] == b'VP8X' and len(chunk) == 9:
+            return bool(chunk[8] & 0x02)
+        if chunk[:4] in (b'VP8 ', b'VP8L'):
+            return False
+    return None
+
+
+def _gif_has_multiple_frames(f) -> Optional[bool]:
+    """Walk GIF blocks until a second image descriptor is found, skipping image data by length"""
+    screen_descriptor = f.read(7)
+    if len(screen_descriptor) < 7:
+        return None
+    if screen_descriptor[4] & 0x80:
+        # Skip the global color table
+        f.seek(3 << ((screen_descriptor[4] & 0x07) + 1), os.SEEK_CUR)
+    
+    frames = 0
+    while True:
+        block = f.read(1)
+        if block == b'\x2c':  # Image descriptor
+            frames += 1
+            if frames > 1:
+                return True
+            descriptor = f.read(9)
+            if len(descriptor) < 9:
+                return None
+            if descriptor[8] & 0x80:
+                # Skip the local color table
+                f.seek(3 << ((descriptor[8] & 0x07) + 1), os.SEEK_CUR)
+            f.read(1)  # LZW minimum code size
+        elif block == b'\x21':  # Extension
+            f.read(1)  # Extension label
+        elif block == b'\x3b':  # Trailer
+            return False if frames else None
+        else:
+            return None
+        
+        # Skip the data sub-blocks that follow the image descriptor or extension
+        while True:
+            length = f.read(1)
+            if not length:
+                return None
+            if length == b'\x00':
+                break
+            f.seek(length[0], os.SEEK_CUR)
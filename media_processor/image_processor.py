@@ -4,15 +4,18 @@ Handles image resizing and format conversion
 """
 
 import logging
-from pathlib import Path
+import os
 from typing import Tuple
 from PIL import Image
-from .config import JPEG_QUALITY
+from .config import RESIZE_REDUCING_GAP, get_encode_params
 from .file_utils import FileUtils
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Resampling filter used for every resize
+RESAMPLE_FILTER = Image.Resampling.LANCZOS
+
 
 class ImageProcessor:
     """Image processing operations"""
@@ -27,24 +30,29 @@ class ImageProcessor:
         """Resize image to fit within max dimensions while maintaining aspect ratio"""
         try:
             with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
-                
                 # Calculate new dimensions
                 new_width, new_height = ImageProcessor.calculate_dimensions(img.size[0], img.size[1])
                 
+                # Let JPEGs decode at 1/2, 1/4 or 1/8 scale while keeping the reducing gap above the
+                # target size, as Image.thumbnail does (no-op for other formats)
+                if RESIZE_REDUCING_GAP is not None:
+                    img.draft(None, (int(new_width * RESIZE_REDUCING_GAP),
+                                     int(new_height * RESIZE_REDUCING_GAP)))
+                
+                # Drop alpha and palettes before resizing; grayscale stays single-channel
+                # rather than being expanded to three identical RGB channels
+                if img.mode == 'LA':
+                    img = img.convert('L')
+                elif img.mode in ('RGBA', 'P'):
+                    img = img.convert('RGB')
+                
                 # Resize image
-                resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                resized_img = img.resize((new_width, new_height), RESAMPLE_FILTER,
+                                         reducing_gap=RESIZE_REDUCING_GAP)
                 
                 # Save with appropriate format
-                output_ext = Path(output_path).suffix.lower()
-                if output_ext == '.jpg':
-                    resized_img.save(output_path, 'JPEG', quality=JPEG_QUALITY)
-                elif output_ext == '.png':
-                    resized_img.save(output_path, 'PNG')
-                else:
-                    resized_img.save(output_path)
+                output_ext = os.path.splitext(output_path)[1].lower()
+                resized_img.save(output_path, **get_encode_params('image', output_ext))
                 
                 return True
                 
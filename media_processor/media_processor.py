@@ -5,13 +5,21 @@ Orchestrates the media processing workflow
 
 import logging
 import os
-from typing import Optional, Tuple
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 from config import ensure_media_folder_exists, DEFAULT_REGISTRY_FILE
+from .config import HASH_ALGORITHM, PROCESSING_INFO_CACHE_SIZE, PROCESSING_WORKERS, STALE_UPLOAD_AGE
 from .registry import MediaRegistry
 from .file_utils import FileUtils
 from .image_processor import ImageProcessor
 from .video_processor import VideoProcessor
 
+# Set up logging
+logger = logging.getLogger(__name__)
+
 
 class MediaProcessor:
     """Main media processing orchestrator"""
@@ -29,39 +37,93 @@ class MediaProcessor:
         self.registry_path = registry_path
         # Ensure media folder exists and get its path
         self.upload_folder = ensure_media_folder_exists(registry_path)
+        # Folder name used as the prefix of the relative paths stored in the registry
+        self.upload_folder_name = os.path.basename(self.upload_folder)
+        self.remove_stale_uploads()
     
-    def process_media_file(self, file_path: str, registry=None) -> Tuple[Optional[str], Optional[str]]:
+    def process_media_file(self, file_path: str, registry=None,
+                           filename: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
         """
         Process a single media file: resize and convert if necessary
         
         Args:
             file_path: Path to the file to process
             registry: Optional registry instance for filename collision detection
+            filename: Original filename, if file_path doesn't carry it (e.g. a partial upload)
         
         Returns:
             Tuple of (relative_path, error_message)
             If successful: (relative_path, None)
             If failed: (None, error_message)
         """
-        filename = os.path.basename(file_path)
-        file_type = FileUtils.get_file_type(filename, file_path)
+        output, error = self._plan_output(file_path, registry, filename)
+        if error:
+            return None, error
+        result = self._convert_media(file_path, *output)
+        if result[1] and registry:
+            registry.release_filename(output[1])
+        return result
+    
+    def process_media_files(self, file_paths: List[str], registry=None,
+                            max_workers: int = PROCESSING_WORKERS) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Process several media files concurrently
         
-        if not file_type:
-            return None, "Unsupported file type"
+        Output filenames are reserved in the registry one file at a time before any
+        conversion starts, so files in the same batch get distinct names when a registry
+        is provided. Successful outputs keep their names reserved until add_media.
         
-        # Calculate hash of original file for duplicate detection
-        original_hash = FileUtils.calculate_file_hash(file_path)
+        Args:
+            file_paths: Paths of the files to process
+            registry: Optional registry instance for filename collision detection
+            max_workers: Number of files converted at once
+        
+        Returns:
+            List of (relative_path, error_message) tuples in the order of file_paths
+        """
+        results = [None] * len(file_paths)
+        jobs = []
+        for i, file_path in enumerate(file_paths):
+            output, error = self._plan_output(file_path, registry)
+            if error:
+                results[i] = (None, error)
+            else:
+                jobs.append((i, file_path, output))
         
-        # Determine output format
-        output_ext = FileUtils.get_output_format(filename, file_type, file_path)
+        # Pillow and ffmpeg do their work outside the GIL, so threads convert files in parallel
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(i, output, executor.submit(self._convert_media, file_path, *output))
+                       for i, file_path, output in jobs]
+            for i, output, future in futures:
+                results[i] = future.result()
+                if results[i][1] and registry:
+                    registry.release_filename(output[1])
+        return results
+    
+    def _plan_output(self, file_path: str, registry=None,
+                     filename: Optional[str] = None) -> Tuple[Optional[Tuple[str, str]], Optional[str]]:
+        """Pick the file type and output filename for a file, or return an error message"""
+        if filename is None:
+            filename = os.path.basename(file_path)
+        # Determine file type and output format
+        file_type, output_ext = FileUtils.classify(filename, file_path)
+        
+        if not file_type:
+            return None, "Unsupported file type"
         
         # Create output filename
         output_filename = FileUtils.create_output_filename(filename, output_ext)
         
-        # Handle filename collisions if registry is provided
+        # Handle filename collisions if registry is provided, holding the name so a concurrent
+        # conversion can't pick it before this one is added to the registry
         if registry:
-            output_filename = registry.get_unique_filename(output_filename)
+            output_filename = registry.reserve_unique_filename(output_filename)
         
+        return (file_type, output_filename), None
+    
+    def _convert_media(self, file_path: str, file_type: str,
+                       output_filename: str) -> Tuple[Optional[str], Optional[str]]:
+        """Resize/convert a file into the media folder under output_filename"""
         output_path = os.path.join(self.upload_folder, output_filename)
         
         try:
@@ -74,19 +136,75 @@ class MediaProcessor:
                 return None, f"Failed to process {file_type}"
             
             # Return relative path for registry (always use forward slashes for cross-platform compatibility)
-            folder_name = os.path.basename(self.upload_folder)
-            relative_path = FileUtils.normalize_path(f'{folder_name}/{output_filename}')
+            relative_path = FileUtils.normalize_path(f'{self.upload_folder_name}/{output_filename}')
             return relative_path, None
             
         except Exception as e:
             return None, str(e)
     
-    def get_file_hash(self, file_path: str) -> str:
+    def get_media_path(self, relative_path: str) -> str:
+        """Get the full path of a media file from its relative registry path"""
+        return os.path.join(self.upload_folder, relative_path.rpartition('/')[2])
+    
+    def get_file_hash(self, file_path: str, algorithm: str = HASH_ALGORITHM) -> str:
         """Get the hash of a file for duplicate detection"""
-        return FileUtils.calculate_file_hash(file_path)
+        return FileUtils.calculate_file_hash(file_path, algorithm)
+    
+    def create_upload_path(self, filename: str) -> str:
+        """Get a unique hidden path in the media folder for an upload being received"""
+        # Keep the original extension, which processors use to pick the conversion (e.g. WebP)
+        ext = os.path.splitext(filename)[1].lower()
+        return os.path.join(self.upload_folder, f'.upload-{uuid.uuid4().hex}.partial{ext}')
     
-    def get_processing_info(self, file_path: str) -> dict:
-        """Get information about a file before processing"""
+    def remove_stale_uploads(self, max_age: float = STALE_UPLOAD_AGE) -> int:
+        """Delete partial uploads left behind by a crash, returning how many were removed"""
+        # Only old files are removed, since another worker process may still be receiving a recent one
+        cutoff = time.time() - max_age
+        removed = 0
+        with os.scandir(self.upload_folder) as entries:
+            for entry in entries:
+                if not entry.name.startswith('.upload-') or '.partial' not in entry.name:
+                    continue
+                try:
+                    if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError as e:
+                    logger.warning(f"Could not remove stale upload {entry.path}: {e}")
+        if removed:
+            logger.info(f"Removed {removed} stale partial upload(s) from {self.upload_folder}")
+        return removed
+    
+    def save_upload(self, stream, file_path: str,
+                    legacy_algorithm: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """Save an uploaded stream to file_path and return its hashes for duplicate detection"""
+        if legacy_algorithm is None:
+            return FileUtils.save_stream_with_hash(stream, file_path), None
+        legacy_hash = FileUtils.create_hasher(legacy_algorithm)
+        file_hash = FileUtils.save_stream_with_hash(stream, file_path, legacy_hash)
+        return file_hash, legacy_hash.hexdigest()
+    
+    def get_cached_processing_info(self, file_path: str) -> dict:
+        """Get processing info, reusing the previous result while the file is unchanged"""
+        stat = os.stat(file_path)
+        return dict(_get_processing_info_cached(file_path, stat.st_mtime_ns, stat.st_size))
+    
+    def get_processing_info_batch(self, entries: Iterable[Union[str, os.DirEntry]]) -> Dict[str, dict]:
+        """Get cached processing info for many files, reusing the stat results of os.scandir entries"""
+        results = {}
+        for entry in entries:
+            if isinstance(entry, os.DirEntry):
+                # DirEntry caches its stat; not following symlinks lets Windows fill it from the listing,
+                # while symlinks still report their target like os.stat does for plain paths
+                file_path, stat = entry.path, entry.stat(follow_symlinks=entry.is_symlink())
+            else:
+                file_path, stat = entry, os.stat(entry)
+            results[file_path] = dict(_get_processing_info_cached(file_path, stat.st_mtime_ns, stat.st_size))
+        return results
+    
+    @staticmethod
+    def get_processing_info(file_path: str, file_size: Optional[int] = None) -> dict:
+        """Get information about a file before processing (file_size skips the stat if already known)"""
         filename = os.path.basename(file_path)
         file_type = FileUtils.get_file_type(filename, file_path)
         
@@ -96,7 +214,8 @@ class MediaProcessor:
         info = {
             'filename': filename,
             'file_type': file_type,
-            'original_size': FileUtils.format_file_size(os.path.getsize(file_path))
+            'original_size': FileUtils.format_file_size(
+                os.path.getsize(file_path) if file_size is None else file_size)
         }
         
         if file_type == 'image':
@@ -107,3 +226,9 @@ class MediaProcessor:
             info.update(video_info)
         
         return info
+
+
+@lru_cache(maxsize=PROCESSING_INFO_CACHE_SIZE)
+def _get_processing_info_cached(file_path: str, mtime_ns: int, size: int) -> dict:
+    """Processing info for one version of a file (mtime and size are part of the cache key)"""
+    return MediaProcessor.get_processing_info(file_path, size)
@@ -3,21 +3,71 @@ Media Registry Management
 Handles loading, saving, and managing the media registry JSON file
 """
 
+import contextlib
 import json
 import logging
 import os
-from typing import List, Dict, Any, Optional
-from config import DEFAULT_REGISTRY_FILE
+import threading
+from typing import Collection, List, Dict, Any, Optional, Tuple
+from config import DEFAULT_REGISTRY_FILE, dumps_json, loads_json
+from .file_utils import FileUtils
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# One lock per registry file, shared by every MediaRegistry and TagRegistry instance that writes it
+_registry_locks: Dict[str, threading.RLock] = {}
+_registry_locks_guard = threading.Lock()
+
+
+def get_registry_lock(registry_file: str) -> threading.RLock:
+    """Get the process-wide lock that serializes read-modify-write updates of a registry file"""
+    key = os.path.abspath(registry_file)
+    with _registry_locks_guard:
+        lock = _registry_locks.get(key)
+        if lock is None:
+            lock = _registry_locks[key] = threading.RLock()
+        return lock
+
+
+def write_registry_file(registry_file: str, registry: List[Dict[str, Any]]) -> bool:
+    """Write registry contents to a temporary file and atomically swap it into place"""
+    temp_file = f'{registry_file}.tmp'
+    try:
+        # Ensure the directory exists (only if there is a directory path)
+        registry_dir = os.path.dirname(registry_file)
+        if registry_dir:  # Only create directory if there's a path component
+            os.makedirs(registry_dir, exist_ok=True)
+        with open(temp_file, 'wb') as f:
+            f.write(dumps_json(registry))
+        os.replace(temp_file, registry_file)
+        return True
+    except IOError as e:
+        logger.error(f"Error saving registry: {e}")
+        with contextlib.suppress(OSError):
+            os.remove(temp_file)
+        return False
+
 
 class MediaRegistry:
     """Manages the media registry file operations"""
     
     def __init__(self, registry_file: str = DEFAULT_REGISTRY_FILE):
         self.registry_file = registry_file
+        # Parsed registry contents, reused until the file on disk changes
+        self._entries: List[Dict[str, Any]] = []
+        self._cache_key: Optional[Tuple[int, int, int]] = None
+        # Maps original_hash -> index of the most recent entry with that hash
+        self._hash_to_index: Dict[str, int] = {}
+        # Number of entries still hashed with the legacy algorithm
+        self._legacy_hash_count = 0
+        # Filenames of all entries, built on the first collision check
+        self._filenames: Optional[set] = None
+        # Filenames picked for conversions still in progress, held until add_media or release_filename
+        self._in_flight: set = set()
+        # Guards the cache and read-modify-write updates under a threaded server; shared with
+        # TagRegistry so tag saves and media updates to the same file cannot overwrite each other
+        self._lock = get_registry_lock(registry_file)
     
     def get_registry_path(self) -> str:
         """Get the full path to the registry file"""
@@ -38,40 +88,84 @@ class MediaRegistry:
             return "Active Registry"
         return os.path.basename(registry_dir) or "Root"
     
+    def _get_cache_key(self) -> Optional[Tuple[int, int, int]]:
+        """Identify the current version of the registry file by inode, mtime and size"""
+        try:
+            stat = os.stat(self.registry_file)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def get_etag(self) -> Optional[str]:
+        """Get an ETag for the current version of the registry file, or None if it doesn't exist"""
+        cache_key = self._get_cache_key()
+        if cache_key is None:
+            return None
+        return '-'.join(f'{part:x}' for part in cache_key)
+    
+    def _set_cache(self, registry: List[Dict[str, Any]], cache_key: Optional[Tuple[int, int, int]]) -> None:
+        """Store parsed registry contents along with the file version they came from"""
+        self._entries = registry
+        self._cache_key = cache_key
+        self._filenames = None
+        self._index_hashes(registry)
+    
+    def _load_entries(self) -> List[Dict[str, Any]]:
+        """Get the cached entries, re-parsing the file only when it changed (callers must not modify them)"""
+        with self._lock:
+            cache_key = self._get_cache_key()
+            if cache_key is None:
+                self._set_cache([], None)
+            elif cache_key != self._cache_key:
+                try:
+                    with open(self.registry_file, 'rb') as f:
+                        registry = loads_json(f.read())
+                except (json.JSONDecodeError, UnicodeDecodeError, IOError) as e:
+                    logger.error(f"Error loading registry: {e}")
+                    self._set_cache([], None)
+                else:
+                    self._set_cache(registry, cache_key)
+            return self._entries
+    
     def load(self) -> List[Dict[str, Any]]:
-        """Load the media registry from JSON file"""
-        if os.path.exists(self.registry_file):
-            try:
-                with open(self.registry_file, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                logger.error(f"Error loading registry: {e}")
-                return []
-        return []
+        """Load the media registry from JSON file (re-parsed only when the file changes)"""
+        # Return a copy so callers can modify the list without touching the cache
+        return list(self._load_entries())
+    
+    def _write(self, registry: List[Dict[str, Any]]) -> bool:
+        """Write registry contents to a temporary file and atomically swap it into place"""
+        return write_registry_file(self.registry_file, registry)
     
     def save(self, registry: List[Dict[str, Any]]) -> bool:
         """Save the media registry to JSON file"""
-        try:
-            # Ensure the directory exists (only if there is a directory path)
-            registry_dir = os.path.dirname(self.registry_file)
-            if registry_dir:  # Only create directory if there's a path component
-                os.makedirs(registry_dir, exist_ok=True)
-            with open(self.registry_file, 'w') as f:
-                json.dump(registry, f, indent=2)
+        with self._lock:
+            if not self._write(registry):
+                return False
+            self._set_cache(list(registry), self._get_cache_key())
             return True
-        except IOError as e:
-            logger.error(f"Error saving registry: {e}")
-            return False
     
     def add_media(self, media_path: str, original_hash: str = None) -> bool:
         """Add a new media entry to the registry (most recent first)"""
-        registry = self.load()
-        # Insert at the beginning to maintain reverse chronological order
-        entry = {'path': media_path}
-        if original_hash:
-            entry['original_hash'] = original_hash
-        registry.insert(0, entry)
-        return self.save(registry)
+        with self._lock:
+            registry = self.load()
+            # Insert at the beginning to maintain reverse chronological order
+            entry = {'path': media_path}
+            if original_hash:
+                entry['original_hash'] = original_hash
+            registry.insert(0, entry)
+            if not self._write(registry):
+                return False
+            
+            # Update the cache in place rather than rebuilding the hash index
+            self._entries = registry
+            self._cache_key = self._get_cache_key()
+            self._add_to_hash_index(original_hash)
+            filename = media_path.rpartition('/')[2]
+            if self._filenames is not None:
+                self._filenames.add(filename)
+            # The entry now holds the name, so its reservation is no longer needed
+            self._in_flight.discard(filename)
+            return True
     
     def get_all_media(self) -> List[Dict[str, Any]]:
         """Get all media entries from the registry"""
@@ -79,54 +173,151 @@ class MediaRegistry:
     
     def get_media_by_index(self, index: int) -> Dict[str, Any]:
         """Get a specific media entry by index"""
-        registry = self.load()
+        registry = self._load_entries()
         if 0 <= index < len(registry):
-            return registry[index]
+            # Copy the entry so callers can add fields without touching the cache
+            return dict(registry[index])
         return None
     
     def get_media_count(self) -> int:
         """Get the total number of media entries"""
-        return len(self.load())
+        return len(self._load_entries())
     
     def remove_media_by_index(self, index: int) -> bool:
         """Remove a media entry by index"""
-        registry = self.load()
-        if 0 <= index < len(registry):
-            registry.pop(index)
-            return self.save(registry)
-        return False
+        with self._lock:
+            registry = self.load()
+            if not 0 <= index < len(registry):
+                return False
+            del registry[index]
+            if not self._write(registry):
+                return False
+            
+            # Update the cache in place rather than rebuilding the hash index
+            removed_hash = self._entries[index].get('original_hash')
+            self._entries = registry
+            self._cache_key = self._get_cache_key()
+            # Another entry may share the removed filename, so rebuild the set on next use
+            self._filenames = None
+            self._remove_from_hash_index(index, removed_hash)
+            return True
     
     def clear_registry(self) -> bool:
         """Clear all entries from the registry"""
         return self.save([])
     
+    def _index_hashes(self, registry: List[Dict[str, Any]]) -> None:
+        """Rebuild the hash -> index lookup table for the given registry contents"""
+        hash_to_index = {}
+        legacy_hash_count = 0
+        for index, entry in enumerate(registry):
+            original_hash = entry.get('original_hash')
+            if not original_hash:
+                continue
+            if FileUtils.is_legacy_hash(original_hash):
+                legacy_hash_count += 1
+            # Keep the first (most recent) entry for each hash
+            if original_hash not in hash_to_index:
+                hash_to_index[original_hash] = index
+        self._hash_to_index = hash_to_index
+        self._legacy_hash_count = legacy_hash_count
+    
+    def _add_to_hash_index(self, added_hash: Optional[str]) -> None:
+        """Shift the hash index after a new entry was inserted at the front of the cached entries"""
+        hash_to_index = {h: i + 1 for h, i in self._hash_to_index.items()}
+        if added_hash:
+            if FileUtils.is_legacy_hash(added_hash):
+                self._legacy_hash_count += 1
+            # The newest entry is the one duplicates resolve to
+            hash_to_index[added_hash] = 0
+        self._hash_to_index = hash_to_index
+    
+    def _remove_from_hash_index(self, index: int, removed_hash: Optional[str]) -> None:
+        """Shift the hash index after the entry at index was removed from the cached entries"""
+        hash_to_index = {
+            h: i - 1 if i > index else i
+            for h, i in self._hash_to_index.items()
+            if i != index
+        }
+        if removed_hash:
+            if FileUtils.is_legacy_hash(removed_hash):
+                self._legacy_hash_count -= 1
+            if removed_hash not in hash_to_index:
+                # An older entry with the same hash now becomes the one duplicates resolve to
+                for i in range(index, len(self._entries)):
+                    if self._entries[i].get('original_hash') == removed_hash:
+                        hash_to_index[removed_hash] = i
+                        break
+        self._hash_to_index = hash_to_index
+    
+    def has_legacy_hashes(self) -> bool:
+        """Check if any entry still has a hash from the legacy algorithm"""
+        with self._lock:
+            self._load_entries()
+            return self._legacy_hash_count > 0
+    
+    def migrate_legacy_hash(self, legacy_hash: str, original_hash: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Find the entry with a legacy hash and store original_hash in its place, or (None, -1) if none exists"""
+        # Lookup and rewrite share one lock hold, so a concurrent add or delete can't shift the index
+        with self._lock:
+            registry = self.load()
+            index = self._hash_to_index.get(legacy_hash)
+            if index is None:
+                return None, -1
+            registry[index] = dict(registry[index], original_hash=original_hash)
+            if not self.save(registry):
+                logger.error(f"Failed to migrate legacy hash of {registry[index]['path']}")
+            return dict(registry[index]), index
+    
+    def find_duplicate_with_index(self, file_hash: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Find a media entry with the same hash and its index, or (None, -1) if none exists"""
+        with self._lock:
+            registry = self._load_entries()
+            index = self._hash_to_index.get(file_hash)
+            if index is None:
+                return None, -1
+            return registry[index], index
+    
     def find_duplicate_by_hash(self, file_hash: str) -> Optional[Dict[str, Any]]:
         """Find a media entry with the same hash, if it exists"""
-        registry = self.load()
-        for entry in registry:
-            if entry.get('original_hash') == file_hash:
-                return entry
-        return None
+        return self.find_duplicate_with_index(file_hash)[0]
     
     def find_filename_collision(self, filename: str) -> bool:
         """Check if a filename already exists in the registry"""
-        registry = self.load()
-        for entry in registry:
-            if entry['path'].split('/')[-1] == filename:
-                return True
-        return False
+        with self._lock:
+            registry = self._load_entries()
+            if self._filenames is None:
+                self._filenames = {entry['path'].rpartition('/')[2] for entry in registry}
+            return filename in self._filenames
+    
+    def _is_filename_taken(self, filename: str, reserved: Collection[str]) -> bool:
+        """Check if a filename is used by an entry, a conversion in progress or the reserved names"""
+        return filename in reserved or filename in self._in_flight or self.find_filename_collision(filename)
+    
+    def get_unique_filename(self, base_filename: str, reserved: Collection[str] = ()) -> str:
+        """Generate a unique filename by adding a numeric suffix if needed (also avoiding reserved names)"""
+        with self._lock:
+            if not self._is_filename_taken(base_filename, reserved):
+                return base_filename
+            
+            # Split filename into name and extension
+            name, ext = os.path.splitext(base_filename)
+            counter = 1
+            
+            while True:
+                new_filename = f"{name}-{counter}{ext}"
+                if not self._is_filename_taken(new_filename, reserved):
+                    return new_filename
+                counter += 1
+    
+    def reserve_unique_filename(self, base_filename: str) -> str:
+        """Pick a unique filename and hold it for a conversion until add_media or release_filename"""
+        with self._lock:
+            filename = self.get_unique_filename(base_filename)
+            self._in_flight.add(filename)
+            return filename
     
-    def get_unique_filename(self, base_filename: str) -> str:
-        """Generate a unique filename by adding a numeric suffix if needed"""
-        if not self.find_filename_collision(base_filename):
-            return base_filename
-        
-        # Split filename into name and extension
-        name, ext = os.path.splitext(base_filename)
-        counter = 1
-        
-        while True:
-            new_filename = f"{name}-{counter}{ext}"
-            if not self.find_filename_collision(new_filename):
-                return new_filename
-            counter += 1
+    def release_filename(self, filename: str) -> None:
+        """Drop the reservation on a filename whose conversion failed or was never registered"""
+        with self._lock:
+            self._in_flight.discard(filename)
@@ -3,19 +3,17 @@ Video Processing Module
 Handles video resizing and format conversion
 """
 
+import importlib.util
 import logging
+import os
 import subprocess
 from pathlib import Path
-import ffmpeg
 from typing import Tuple, Optional, Dict, Any
-from .config import VIDEO_CRF_MP4, VIDEO_CRF_WEBM
+from .config import DECODE_PARAMS, ENCODER_CODEC_NAMES, HW_SCALE_FILTERS, get_encode_params
 from .file_utils import FileUtils
 
-try:
-    from wand.image import Image as WandImage
-    WAND_AVAILABLE = True
-except ImportError:
-    WAND_AVAILABLE = False
+# ffmpeg and Wand are imported where they are used; importing Wand loads MagickWand through ctypes
+WAND_AVAILABLE = importlib.util.find_spec('wand') is not None
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -29,6 +27,30 @@ class VideoProcessor:
         """Calculate new dimensions for video processing (ensures even numbers)"""
         return FileUtils.calculate_dimensions(width, height, ensure_even=True)
     
+    @staticmethod
+    def scale_filter(width: int, height: int) -> str:
+        """Build the -vf scale chain, scaling on the GPU when decoded frames are kept there"""
+        hw_filter = HW_SCALE_FILTERS.get(DECODE_PARAMS.get('hwaccel_output_format'))
+        if hw_filter:
+            # libvpx-vp9 encodes on the CPU, so download the frames once they are scaled down
+            return f'{hw_filter}={width}:{height}:format=yuv420p,hwdownload,format=yuv420p'
+        return f'scale={width}:{height}'
+    
+    @staticmethod
+    def probe_video_stream(video_path: str) -> Dict[str, Any]:
+        """Get the ffprobe description of the first video stream"""
+        import ffmpeg
+        
+        # Only report the first video stream rather than every stream in the container
+        probe = ffmpeg.probe(video_path, select_streams='v:0')
+        return next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    
+    @staticmethod
+    def probe_dimensions(video_path: str) -> Tuple[int, int]:
+        """Get the width and height of the first video stream"""
+        video_info = VideoProcessor.probe_video_stream(video_path)
+        return int(video_info['width']), int(video_info['height'])
+    
     @staticmethod
     def convert_webp_to_webm(webp_path: str, output_path: str) -> bool:
         """Convert animated WebP to WebM using Wand/ImageMagick"""
@@ -36,6 +58,12 @@ class VideoProcessor:
             logger.warning("Wand/ImageMagick not available for WebP conversion")
             return False
         
+        try:
+            from wand.image import Image as WandImage
+        except ImportError as e:
+            logger.warning(f"Wand/ImageMagick could not be loaded for WebP conversion: {e}")
+            return False
+        
         try:
             with WandImage(filename=webp_path) as img:
                 # Check if the image is animated by counting frames
@@ -64,6 +92,8 @@ class VideoProcessor:
     @staticmethod
     def resize_video(video_path: str, output_path: str) -> bool:
         """Resize video to fit within max dimensions while maintaining aspect ratio"""
+        import ffmpeg
+        
         # Check if this is an animated WebP file
         input_ext = Path(video_path).suffix.lower()
         is_animated_webp = input_ext == '.webp'
@@ -71,82 +101,70 @@ class VideoProcessor:
         # For animated WebP files, use Wand/ImageMagick for conversion
         if is_animated_webp:
             logger.info(f"Processing animated WebP with Wand: {video_path}")
-            # First convert WebP to WebM using Wand
-            if VideoProcessor.convert_webp_to_webm(video_path, output_path):
-                # If conversion successful, try to resize the resulting WebM
-                try:
-                    # Get dimensions of the converted WebM
-                    probe = ffmpeg.probe(output_path)
-                    video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-                    width = int(video_info['width'])
-                    height = int(video_info['height'])
-                    
-                    # Calculate new dimensions
-                    new_width, new_height = VideoProcessor.calculate_dimensions(width, height)
-                    
-                    # Create a temporary file for resizing
-                    temp_output = str(Path(output_path).with_suffix('.temp.webm'))
-                    
-                    # Resize the WebM using FFmpeg
-                    stream = ffmpeg.input(output_path)
-                    stream = ffmpeg.output(stream, temp_output, 
-                                         vcodec='libvpx-vp9', 
-                                         acodec='libopus',
-                                         vf=f'scale={new_width}:{new_height}',
-                                         crf=VIDEO_CRF_WEBM)
-                    ffmpeg.run(stream, overwrite_output=True)
-                    
-                    # Replace the original output with the resized version
-                    import os
-                    import time
-                    try:
-                        os.replace(temp_output, output_path)
-                    except OSError as e:
-                        # If replace fails due to file locking, try a different approach
-                        logger.warning(f"File replacement failed, trying alternative method: {e}")
-                        try:
-                            # Wait a moment and try again
-                            time.sleep(0.1)
-                            if os.path.exists(temp_output):
-                                os.remove(output_path)
-                                os.rename(temp_output, output_path)
-                        except Exception as e2:
-                            logger.error(f"Alternative file replacement also failed: {e2}")
-                            # If all else fails, just keep the temp file
-                            if os.path.exists(temp_output):
-                                os.rename(temp_output, output_path)
-                    
-                    logger.info(f"Successfully processed animated WebP: {output_path}")
-                    return True
-                    
-                except Exception as resize_error:
-                    logger.error(f"Error resizing converted WebM: {resize_error}")
-                    # If resizing fails, we still have the converted WebM, so return success
-                    return True
-            else:
+            # Wand writes an intermediate WebM, which FFmpeg scales and encodes straight into output_path
+            converted_path = str(Path(output_path).with_suffix('.temp.webm'))
+            if not VideoProcessor.convert_webp_to_webm(video_path, converted_path):
                 logger.error(f"Failed to convert WebP to WebM with Wand: {video_path}")
                 logger.info("This WebP file may not be animated or may be corrupted.")
                 logger.info("It will be processed as a static image instead.")
                 return False
+            
+            try:
+                # Get dimensions of the converted WebM
+                width, height = VideoProcessor.probe_dimensions(converted_path)
+                
+                # Calculate new dimensions
+                new_width, new_height = VideoProcessor.calculate_dimensions(width, height)
+                
+                # Resize the WebM using FFmpeg
+                stream = ffmpeg.input(converted_path, **DECODE_PARAMS)
+                stream = ffmpeg.output(stream, output_path, 
+                                     vf=VideoProcessor.scale_filter(new_width, new_height),
+                                     **get_encode_params('video', '.webm'))
+                ffmpeg.run(stream, overwrite_output=True)
+                
+                logger.info(f"Successfully processed animated WebP: {output_path}")
+                return True
+                
+            except Exception as resize_error:
+                logger.error(f"Error resizing converted WebM: {resize_error}")
+                # If resizing fails, we still have the converted WebM, so keep it as the output
+                try:
+                    os.replace(converted_path, output_path)
+                    return True
+                except OSError as e:
+                    logger.error(f"Could not keep the converted WebM: {e}")
+                    return False
+            finally:
+                if os.path.exists(converted_path):
+                    try:
+                        os.remove(converted_path)
+                    except OSError as e:
+                        logger.warning(f"Could not remove intermediate WebM {converted_path}: {e}")
         
         # For non-WebP files, use the original FFmpeg approach
         try:
             # Get video properties
-            probe = ffmpeg.probe(video_path)
-            video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-            width = int(video_info['width'])
-            height = int(video_info['height'])
+            video_info = VideoProcessor.probe_video_stream(video_path)
+            width, height = int(video_info['width']), int(video_info['height'])
             
             # Calculate new dimensions
             new_width, new_height = VideoProcessor.calculate_dimensions(width, height)
             
             # Convert all videos to WebM format
-            stream = ffmpeg.input(video_path)
-            stream = ffmpeg.output(stream, output_path, 
-                                 vcodec='libvpx-vp9', 
-                                 acodec='libopus',
-                                 vf=f'scale={new_width}:{new_height}',
-                                 crf=VIDEO_CRF_WEBM)
+            encode_params = get_encode_params('video', '.webm')
+            target_codec = ENCODER_CODEC_NAMES.get(encode_params.get('vcodec'))
+            if (new_width, new_height) == (width, height) and video_info.get('codec_name') == target_codec:
+                # Already the target size and codec, so copy the video stream instead of re-encoding it
+                logger.info(f"Video already matches target, copying video stream: {video_path}")
+                stream = ffmpeg.input(video_path)
+                stream = ffmpeg.output(stream, output_path, vcodec='copy',
+                                     acodec=encode_params.get('acodec', 'copy'))
+            else:
+                stream = ffmpeg.input(video_path, **DECODE_PARAMS)
+                stream = ffmpeg.output(stream, output_path, 
+                                     vf=VideoProcessor.scale_filter(new_width, new_height),
+                                     **encode_params)
             
             ffmpeg.run(stream, overwrite_output=True)
             return True
@@ -175,6 +193,7 @@ class VideoProcessor:
                     'bitrate': 0
                 }
             else:
+                import ffmpeg
                 probe = ffmpeg.probe(video_path)
                 video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
                 audio_info = next((s for s in probe['streams'] if s['codec_type'] == 'audio'), None)
@@ -3,92 +3,90 @@ Tag Dependency Manager
 Handles analysis of tag dependencies and ordering for proper tag presentation
 """
 
+import heapq
 import re
-from typing import List, Dict, Set, Any
+from typing import List, Dict, FrozenSet, Any
 from collections import defaultdict
 
+# String literals in conditions (either quote style), removed before looking for variables
+STRING_LITERAL_PATTERN = re.compile(r'"[^"]*"|\'[^\']*\'')
+# Identifiers (variable names) - sequences of letters, numbers, and underscores
+IDENTIFIER_PATTERN = re.compile(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b')
+# Operators and keywords that look like identifiers but aren't variables
+CONDITION_KEYWORDS = frozenset({'and', 'or', 'not', 'true', 'false', 'null', 'undefined'})
+
 
 class TagDependencyManager:
     """Manages tag dependencies and ordering"""
     
     def __init__(self):
-        self.tag_dependencies: Dict[str, Set[str]] = {}
+        self.tag_dependencies: Dict[str, FrozenSet[str]] = {}
         self.tag_config: Dict[str, Any] = {}
     
     def analyze_dependencies(self, tag_config: Dict[str, Any]) -> Dict[str, List[str]]:
         """Analyze dependencies for all tags in the configuration"""
-        self.tag_config = tag_config
-        self.tag_dependencies = {}
+        # Build into a local and publish with one assignment, so a concurrent get_ordered_tags
+        # never sees a half-filled dependency map
+        tag_dependencies: Dict[str, FrozenSet[str]] = {}
         
         if 'tags' not in tag_config:
+            self.tag_config, self.tag_dependencies = tag_config, tag_dependencies
             return {}
         
         # Analyze each tag's dependencies
         for tag_name, tag_info in tag_config['tags'].items():
-            dependencies = []
-            seen_deps = set()
+            dependencies = set()
             
             # Check tag-level requirements
             if 'req' in tag_info:
-                deps = self._extract_variables_from_condition(tag_info['req'])
-                for dep in deps:
-                    if dep not in seen_deps:
-                        dependencies.append(dep)
-                        seen_deps.add(dep)
+                dependencies.update(self._extract_variables_from_condition(tag_info['req']))
             
             # Check value-level requirements
             if 'values' in tag_info:
                 for value_item in tag_info['values']:
                     if isinstance(value_item, dict) and 'req' in value_item:
-                        deps = self._extract_variables_from_condition(value_item['req'])
-                        for dep in deps:
-                            if dep not in seen_deps:
-                                dependencies.append(dep)
-                                seen_deps.add(dep)
+                        dependencies.update(self._extract_variables_from_condition(value_item['req']))
             
-            self.tag_dependencies[tag_name] = set(dependencies)
+            tag_dependencies[tag_name] = frozenset(dependencies)
+        
+        self.tag_config, self.tag_dependencies = tag_config, tag_dependencies
         
-        # Return dependencies as lists, preserving order as they appear in conditions
-        return {tag: list(deps) for tag, deps in self.tag_dependencies.items()}
+        # Return dependencies as lists
+        return {tag: list(deps) for tag, deps in tag_dependencies.items()}
     
     def get_ordered_tags(self, tag_order: List[str]) -> List[str]:
         """Get tags in the correct order based on dependencies"""
         if not tag_order:
             return []
         
-        # Start with the original order
-        ordered_tags = tag_order.copy()
+        # Kahn's algorithm: a tag is ready once all of its dependencies are placed, and the
+        # ready tag that comes first in the original order is always placed next
+        position = {tag_name: i for i, tag_name in enumerate(tag_order)}
+        remaining_deps = {}
+        dependents = defaultdict(list)
+        for tag_name in tag_order:
+            # Dependencies that aren't tags in this order (or the tag itself) don't constrain it
+            dependencies = {dep for dep in self.tag_dependencies.get(tag_name, frozenset())
+                            if dep in position and dep != tag_name}
+            remaining_deps[tag_name] = len(dependencies)
+            for dep in dependencies:
+                dependents[dep].append(tag_name)
         
-        # Keep looping until no changes are made
-        while True:
-            previous_order = ordered_tags.copy()
-            
-            # Loop through the current list of tags
-            for i, tag_name in enumerate(ordered_tags):
-                # Get dependencies for this tag
-                dependencies = self.tag_dependencies.get(tag_name, set())
-                
-                # Find the latest position of any dependency
-                latest_dep_index = -1
-                for dep in dependencies:
-                    for j, check_tag in enumerate(ordered_tags):
-                        if check_tag == dep:
-                            latest_dep_index = max(latest_dep_index, j)
-                            break
-                
-                # If any dependency comes after this tag, move this tag to after the latest dependency
-                if latest_dep_index > i:
-                    # Remove this tag from its current position
-                    ordered_tags.pop(i)
-                    # Insert it after the latest dependency (adjust index since we removed an item)
-                    if latest_dep_index >= i:
-                        latest_dep_index -= 1
-                    ordered_tags.insert(latest_dep_index + 1, tag_name)
-                    break  # Start over since we modified the list
-            
-            # If no changes were made, we're done
-            if ordered_tags == previous_order:
-                break
+        ready = [position[tag_name] for tag_name in tag_order if remaining_deps[tag_name] == 0]
+        heapq.heapify(ready)
+        ordered_tags = []
+        while ready:
+            tag_name = tag_order[heapq.heappop(ready)]
+            ordered_tags.append(tag_name)
+            for dependent in dependents[tag_name]:
+                remaining_deps[dependent] -= 1
+                if remaining_deps[dependent] == 0:
+                    heapq.heappush(ready, position[dependent])
+        
+        # Tags in a dependency cycle never become ready; keep them in their original order
+        if len(ordered_tags) < len(tag_order):
+            placed = set(ordered_tags)
+            ordered_tags.extend(tag_name for tag_name in tag_order if tag_name not in placed)
         
         return ordered_tags
     
@@ -99,20 +97,16 @@ class TagDependencyManager:
         
         # Remove string literals first to avoid picking them up as variables
         # This removes anything between quotes
-        condition_without_strings = re.sub(r'"[^"]*"', '', condition)
-        condition_without_strings = re.sub(r"'[^']*'", '', condition_without_strings)
+        condition_without_strings = STRING_LITERAL_PATTERN.sub('', condition)
         
-        # Find identifiers (variable names) - sequences of letters, numbers, and underscores
-        # that are not at the start of a string literal
-        pattern = r'\b[a-zA-Z_][a-zA-Z0-9_]*\b'
-        matches = re.findall(pattern, condition_without_strings)
+        # Find identifiers (variable names)
+        matches = IDENTIFIER_PATTERN.findall(condition_without_strings)
         
         # Filter out operators and keywords, preserving order
-        operators = {'and', 'or', 'not', 'true', 'false', 'null', 'undefined'}
         variables = []
         seen = set()
         for match in matches:
-            if match.lower() not in operators and match not in seen:
+            if match.lower() not in CONDITION_KEYWORDS and match not in seen:
                 variables.append(match)
                 seen.add(match)
         
@@ -121,34 +115,30 @@ class TagDependencyManager:
     def detect_circular_dependencies(self) -> List[List[str]]:
         """Detect circular dependencies in the tag configuration"""
         cycles = []
-        visited = set()
-        rec_stack = set()
+        # Tags missing from state are unvisited; in-progress tags are on the current path
+        IN_PROGRESS, DONE = 1, 2
+        state: Dict[str, int] = {}
         
-        def dfs(tag_name: str, path: List[str]) -> None:
-            """Depth-first search to detect cycles"""
-            if tag_name in rec_stack:
-                # Found a cycle
-                cycle_start = path.index(tag_name)
-                cycle = path[cycle_start:] + [tag_name]
-                cycles.append(cycle)
-                return
+        for start_tag in self.tag_dependencies:
+            if start_tag in state:
+                continue
             
-            if tag_name in visited:
-                return
-            
-            visited.add(tag_name)
-            rec_stack.add(tag_name)
-            path.append(tag_name)
-            
-            # Visit all dependencies
-            for dep in self.tag_dependencies.get(tag_name, set()):
-                dfs(dep, path.copy())
-            
-            rec_stack.remove(tag_name)
-        
-        # Check for cycles starting from each tag
-        for tag_name in self.tag_dependencies:
-            if tag_name not in visited:
-                dfs(tag_name, [])
+            # Iterative depth-first search: stack holds each path tag's remaining dependencies
+            state[start_tag] = IN_PROGRESS
+            path = [start_tag]
+            stack = [iter(self.tag_dependencies[start_tag])]
+            while stack:
+                dep = next(stack[-1], None)
+                if dep is None:
+                    # All dependencies of the tag at the end of the path are explored
+                    stack.pop()
+                    state[path.pop()] = DONE
+                elif dep not in state:
+                    state[dep] = IN_PROGRESS
+                    path.append(dep)
+                    stack.append(iter(self.tag_dependencies.get(dep, ())))
+                elif state[dep] == IN_PROGRESS:
+                    # Found a cycle
+                    cycles.append(path[path.index(dep):] + [dep])
         
         return cycles
@@ -3,186 +3,255 @@ Tag Registry Management
 Handles loading, saving, and managing tags directly in the events_registry.json file
 """
 
+import copy
 import json
 import logging
 import os
+import threading
 import yaml
-from typing import List, Dict, Any, Optional
-from config import get_tag_registry_path
+from typing import List, Dict, Any, Optional, Tuple
+from config import get_tag_registry_path, load_json_file
+from media_processor.registry import get_registry_lock, write_registry_file
 from .tag_dependency_manager import TagDependencyManager
 
+# Prefer the LibYAML-backed loader, which parses much faster than the pure-Python one
+try:
+    from yaml import CSafeLoader as YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Shared TagRegistry instances keyed by absolute registry path (see TagRegistry.get)
+_instances: Dict[str, 'TagRegistry'] = {}
+_instances_lock = threading.Lock()
+
 
 class TagRegistry:
     """Manages tag operations directly in the events_registry.json file"""
     
+    @classmethod
+    def get(cls, media_registry_path: str) -> 'TagRegistry':
+        """Get the process-wide instance for a registry path, so its caches outlive registry switches"""
+        key = os.path.abspath(media_registry_path)
+        with _instances_lock:
+            instance = _instances.get(key)
+            if instance is None:
+                instance = _instances[key] = cls(media_registry_path)
+            return instance
+    
     def __init__(self, media_registry_path: str):
         self.media_registry_path = media_registry_path
         self.yaml_config_path = os.path.join(os.path.dirname(media_registry_path), 'events_tags.yaml')
         self.dependency_manager = TagDependencyManager()
+        # (file version, parsed entries, path -> entry index), swapped as one tuple and reused until the file changes
+        self._cache: Optional[Tuple[Tuple[int, int, int], List[Dict[str, Any]], Dict[str, int]]] = None
+        # (YAML file version, augmented tag config, tag name -> type), reused until the YAML file changes
+        self._tag_config_cache: Optional[Tuple[Tuple[int, int, int], Dict[str, Any], Dict[str, str]]] = None
+        # Serializes YAML parsing, which also runs the shared dependency manager's analysis
+        self._tag_config_lock = threading.Lock()
+        # Same lock MediaRegistry holds while rewriting this file
+        self._write_lock = get_registry_lock(media_registry_path)
     
     def get_tag_registry_path(self) -> str:
         """Get the full path to the media registry file (which now contains tags)"""
         return os.path.abspath(self.media_registry_path)
     
     def get_tag_config(self) -> Dict[str, Any]:
-        """Load tag configuration from the YAML file"""
-        if os.path.exists(self.yaml_config_path):
-            try:
-                with open(self.yaml_config_path, 'r') as f:
-                    config = yaml.safe_load(f)
+        """Load tag configuration from the YAML file (re-parsed only when the file changes)"""
+        # Deep copy so callers can modify the nested tag definitions without touching the cache
+        return copy.deepcopy(self._load_tag_config()[0])
+    
+    def _load_tag_config(self) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Get the cached tag config and tag types, parsing the YAML file only when it changed"""
+        cache_key = self._get_file_version(self.yaml_config_path)
+        cache = self._tag_config_cache
+        if cache_key is not None and cache is not None and cache[0] == cache_key:
+            return cache[1], cache[2]
+        with self._tag_config_lock:
+            # Another thread may have parsed this version while we waited
+            cache = self._tag_config_cache
+            if cache_key is not None and cache is not None and cache[0] == cache_key:
+                return cache[1], cache[2]
+            config = self._parse_tag_config()
+            tag_types = {}
+            for tag_name, tag_info in ((config or {}).get('tags') or {}).items():
+                tag_types[tag_name] = tag_info.get('type', 'string') if isinstance(tag_info, dict) else 'string'
+            self._tag_config_cache = (cache_key, config, tag_types) if cache_key is not None else None
+            return config, tag_types
+    
+    def _parse_tag_config(self) -> Dict[str, Any]:
+        """Parse the YAML tag configuration and add its tag order and dependencies"""
+        # Open directly rather than checking os.path.exists first, saving a stat and a race with deletion
+        try:
+            with open(self.yaml_config_path, 'r') as f:
+                config = yaml.load(f, Loader=YamlSafeLoader)
+                
+                # In Python 3.7+, dict keys preserve insertion order
+                # The YAML loader should preserve the order from the file
+                if 'tags' in config:
+                    tag_order = list(config['tags'].keys())
+                    
+                    # Analyze dependencies and get ordered tags
+                    dependencies = self.dependency_manager.analyze_dependencies(config)
+                    ordered_tags = self.dependency_manager.get_ordered_tags(tag_order)
+                    
+                    # Add both to the response
+                    config['tag_order'] = tag_order
+                    config['ordered_tags'] = ordered_tags
+                    config['dependencies'] = dependencies
                     
-                    # In Python 3.7+, dict keys preserve insertion order
-                    # The YAML loader should preserve the order from the file
-                    if 'tags' in config:
-                        tag_order = list(config['tags'].keys())
-                        print(f"Tag order from YAML: {tag_order}")
-                        
-                        # Analyze dependencies and get ordered tags
-                        dependencies = self.dependency_manager.analyze_dependencies(config)
-                        ordered_tags = self.dependency_manager.get_ordered_tags(tag_order)
-                        
-                        # Add both to the response
-                        config['tag_order'] = tag_order
-                        config['ordered_tags'] = ordered_tags
-                        config['dependencies'] = dependencies
-                        
-                        print(f"Analyzed dependencies: {dependencies}")
-                        print(f"Final ordered tags: {ordered_tags}")
-                        
-                    return config
-            except (yaml.YAMLError, IOError) as e:
-                logger.error(f"Error loading tag configuration from YAML: {e}")
-                return {"tags": {}}
-        else:
+                    # Skip formatting the tag lists unless debug logging is on
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Tag order from YAML: {tag_order}")
+                        logger.debug(f"Analyzed dependencies: {dependencies}")
+                        logger.debug(f"Final ordered tags: {ordered_tags}")
+                    
+                return config
+        except FileNotFoundError:
             logger.warning(f"Tag configuration file not found: {self.yaml_config_path}")
             return {"tags": {}}
+        except (yaml.YAMLError, IOError) as e:
+            logger.error(f"Error loading tag configuration from YAML: {e}")
+            return {"tags": {}}
     
     def get_media_tags(self, media_path: str) -> Dict[str, Any]:
         """Get tags for a specific media file from events_registry.json"""
-        registry_data = self.load_registry()
-        for entry in registry_data:
-            if entry.get('path') == media_path:
-                return entry.get('tags', {})
-        return {}
+        registry_data, path_index = self._load_cached()
+        index = path_index.get(media_path)
+        if index is None:
+            return {}
+        # Copy the tags so callers can modify them without touching the cache
+        return dict(registry_data[index].get('tags', {}))
     
     def set_media_tags(self, media_path: str, tags: Dict[str, Any]) -> bool:
         """Set tags for a specific media file in events_registry.json"""
-        registry_data = self.load_registry()
-        
-        # Convert tag values to appropriate types based on tag configuration
-        converted_tags = self._convert_tag_types(tags)
-        
-        # Find the media entry and update its tags
-        for entry in registry_data:
-            if entry.get('path') == media_path:
-                entry['tags'] = converted_tags
-                return self.save_registry(registry_data)
-        
-        # If media not found, add it with tags
-        registry_data.append({
-            'path': media_path,
-            'original_hash': '',  # Will be set by media processor
-            'tags': converted_tags
-        })
-        return self.save_registry(registry_data)
+        return self.set_media_tags_batch({media_path: tags})
+    
+    def set_media_tags_batch(self, media_tags: Dict[str, Dict[str, Any]]) -> bool:
+        """Set tags for several media files, writing events_registry.json once"""
+        with self._write_lock:
+            # Copy the cached list and replace (rather than modify) entries, so a failed save leaves the cache intact
+            registry_data, path_index = self._load_cached()
+            registry_data = list(registry_data)
+            
+            for media_path, tags in media_tags.items():
+                # Convert tag values to appropriate types based on tag configuration
+                converted_tags = self._convert_tag_types(tags)
+                
+                # Find the media entry and update its tags
+                index = path_index.get(media_path)
+                if index is not None:
+                    registry_data[index] = {**registry_data[index], 'tags': converted_tags}
+                    continue
+                
+                # If media not found, add it with tags
+                registry_data.append({
+                    'path': media_path,
+                    'original_hash': '',  # Will be set by media processor
+                    'tags': converted_tags
+                })
+            return self.save_registry(registry_data)
     
     def _convert_tag_types(self, tags: Dict[str, Any]) -> Dict[str, Any]:
         """Convert tag values to appropriate types based on tag configuration"""
-        tag_config = self.get_tag_config()
+        _, tag_types = self._load_tag_config()
         converted_tags = {}
         
         for tag_name, tag_value in tags.items():
-            if tag_name in tag_config.get('tags', {}):
-                tag_info = tag_config['tags'][tag_name]
-                tag_type = tag_info.get('type', 'string')
-                
-                # Convert value based on type
-                if tag_type == 'int' and tag_value is not None:
-                    try:
-                        # Handle special case where value might be 'many' or other non-numeric
-                        if isinstance(tag_value, str) and tag_value.lower() == 'many':
-                            converted_tags[tag_name] = tag_value
-                        else:
-                            converted_tags[tag_name] = int(tag_value)
-                    except (ValueError, TypeError):
-                        # If conversion fails, keep original value
+            # Only int tags need converting; other types and tags not in the config are kept as is
+            if tag_value is not None and tag_types.get(tag_name) == 'int':
+                try:
+                    # Handle special case where value might be 'many' or other non-numeric
+                    if isinstance(tag_value, str) and tag_value.lower() == 'many':
                         converted_tags[tag_name] = tag_value
-                else:
-                    # For other types, keep as is
+                    else:
+                        converted_tags[tag_name] = int(tag_value)
+                except (ValueError, TypeError):
+                    # If conversion fails, keep original value
                     converted_tags[tag_name] = tag_value
             else:
-                # If tag not in config, keep as is
                 converted_tags[tag_name] = tag_value
         
         return converted_tags
     
+    @staticmethod
+    def _get_file_version(path: str) -> Optional[Tuple[int, int, int]]:
+        """Identify the current version of a file by inode, mtime and size (None if it doesn't exist)"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    @staticmethod
+    def _index_paths(registry_data: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Map each media path to the index of its first entry"""
+        path_index = {}
+        for index, entry in enumerate(registry_data):
+            if 'path' in entry:
+                path_index.setdefault(entry['path'], index)
+        return path_index
+    
+    def _set_cache(self, cache_key: Optional[Tuple[int, int, int]],
+                   registry_data: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """Index and remember entries for the file version they came from"""
+        path_index = self._index_paths(registry_data)
+        self._cache = (cache_key, registry_data, path_index) if cache_key is not None else None
+        return registry_data, path_index
+    
+    def _load_cached(self) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """Get the registry entries and path index, re-parsing only when the file changed (callers must not modify them)"""
+        cache_key = self._get_file_version(self.media_registry_path)
+        cache = self._cache
+        if cache_key is not None and cache is not None and cache[0] == cache_key:
+            return cache[1], cache[2]
+        # Parse under the registry lock: on Windows an open reader makes a writer's os.replace fail
+        with self._write_lock:
+            cache_key = self._get_file_version(self.media_registry_path)
+            cache = self._cache
+            if cache_key is not None and cache is not None and cache[0] == cache_key:
+                return cache[1], cache[2]
+            return self._set_cache(cache_key, self.load_registry())
+    
     def load_registry(self) -> List[Dict[str, Any]]:
         """Load the events registry from JSON file"""
-        if os.path.exists(self.media_registry_path):
-            try:
-                with open(self.media_registry_path, 'r') as f:
-                    data = json.load(f)
-                    # Ensure each entry has a tags field
-                    for entry in data:
-                        if 'tags' not in entry:
-                            entry['tags'] = {}
-                    return data
-            except (json.JSONDecodeError, IOError) as e:
-                logger.error(f"Error loading events registry: {e}")
-                return []
-        else:
+        try:
+            data = load_json_file(self.media_registry_path)
+        except FileNotFoundError:
             logger.warning(f"Events registry file not found: {self.media_registry_path}")
             return []
+        except (json.JSONDecodeError, UnicodeDecodeError, IOError) as e:
+            logger.error(f"Error loading events registry: {e}")
+            return []
+        # Ensure each entry has a tags field
+        for entry in data:
+            if 'tags' not in entry:
+                entry['tags'] = {}
+        return data
     
     def save_registry(self, registry_data: List[Dict[str, Any]]) -> bool:
         """Save the events registry to JSON file"""
-        try:
-            # Ensure the directory exists (only if there is a directory)
-            directory = os.path.dirname(self.media_registry_path)
-            if directory:  # Only create directory if there is one
-                os.makedirs(directory, exist_ok=True)
-            with open(self.media_registry_path, 'w') as f:
-                json.dump(registry_data, f, indent=2)
+        with self._write_lock:
+            # Same atomic temp file + os.replace write as MediaRegistry, so readers never see a partial file
+            if not write_registry_file(self.media_registry_path, registry_data):
+                return False
+            # Keep copies of what was just written instead of parsing it again on the next lookup,
+            # so the caller can keep modifying its own entries without touching the cache
+            cached_entries = [{**entry, 'tags': dict(entry.get('tags', {}))} for entry in registry_data]
+            self._set_cache(self._get_file_version(self.media_registry_path), cached_entries)
             return True
-        except IOError as e:
-            logger.error(f"Error saving events registry: {e}")
-            return False
-    
-    def get_all_tags(self) -> Dict[str, Any]:
-        """Get all tags from the registry (legacy method - returns empty dict)"""
-        return {}
     
     def get_media_tags_old(self) -> Dict[str, Any]:
         """Get all media-tag associations from the registry"""
-        registry_data = self.load_registry()
+        registry_data, _ = self._load_cached()
         media_tags = {}
         for entry in registry_data:
             if 'path' in entry and 'tags' in entry:
-                media_tags[entry['path']] = entry['tags']
+                media_tags[entry['path']] = dict(entry['tags'])
         return media_tags
     
-    def get_tag_categories(self) -> Dict[str, Any]:
-        """Get all tag categories from the registry (legacy method - returns empty dict)"""
-        return {}
-    
-    def add_tag(self, tag_name: str, tag_info: Dict[str, Any]) -> bool:
-        """Add a new tag to the registry (legacy method - no longer used)"""
-        logger.warning("add_tag method is deprecated - tags are now defined in events_tags.yaml")
-        return False
-    
-    def remove_tag(self, tag_name: str) -> bool:
-        """Remove a tag from the registry (legacy method - no longer used)"""
-        logger.warning("remove_tag method is deprecated - tags are now defined in events_tags.yaml")
-        return False
-    
-    def add_media_tags(self, media_path: str, tags: List[str]) -> bool:
-        """Add tags to a media file (legacy method - use set_media_tags instead)"""
-        logger.warning("add_media_tags method is deprecated - use set_media_tags instead")
-        return False
-    
     def remove_media_tags(self, media_path: str) -> bool:
         """Remove all tags from a media file"""
         return self.set_media_tags(media_path, {})
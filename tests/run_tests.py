@@ -3,12 +3,24 @@
 Test runner script for the Media Management Tool
 """
 
+import importlib.util
 import sys
 import subprocess
 import os
 
 
-def run_tests():
+def run_pytest(args, use_subprocess=False):
+    """Run pytest with the given arguments and return its exit code"""
+    if use_subprocess:
+        # A fresh interpreter, for CI setups that want the tests isolated from this process
+        return subprocess.run([sys.executable, "-m", "pytest", *args]).returncode
+    
+    import pytest
+    # In-process, skipping a second interpreter start-up and re-import of pytest and the test dependencies
+    return int(pytest.main(args))
+
+
+def run_tests(use_subprocess=False):
     """Run the test suite"""
     print("🧪 Running Media Management Tool Test Suite")
     print("=" * 50)
@@ -19,51 +31,56 @@ def run_tests():
     except ImportError:
         print("❌ pytest is not installed. Please install it with:")
         print("   pip install pytest pytest-cov pytest-mock")
+        print("   (optionally pytest-xdist to run the tests on all CPU cores)")
         return 1
     
     # Run tests with coverage
-    cmd = [
-        sys.executable, "-m", "pytest",
+    args = [
         "--cov=media_processor",
         "--cov=app",
         "--cov-report=term-missing",
         "--cov-report=html:htmlcov",
         "-v"
     ]
+    # Spread the tests over all cores when pytest-xdist is installed (pytest-cov combines the coverage);
+    # loadfile keeps each test file on a single worker
+    if importlib.util.find_spec("xdist") is not None:
+        args += ["-n", "auto", "--dist=loadfile"]
     
-    try:
-        result = subprocess.run(cmd, check=True)
+    exit_code = run_pytest(args, use_subprocess)
+    if exit_code == 0:
         print("\n✅ All tests passed!")
         print("\n📊 Coverage report generated in htmlcov/")
-        return 0
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ Tests failed with exit code {e.returncode}")
-        return e.returncode
+    else:
+        print(f"\n❌ Tests failed with exit code {exit_code}")
+    return exit_code
 
 
-def run_specific_tests(test_path=None):
+def run_specific_tests(test_path=None, use_subprocess=False):
     """Run specific tests"""
     if test_path is None:
-        return run_tests()
+        return run_tests(use_subprocess)
     
-    cmd = [sys.executable, "-m", "pytest", test_path, "-v"]
-    
-    try:
-        result = subprocess.run(cmd, check=True)
+    exit_code = run_pytest([test_path, "-v"], use_subprocess)
+    if exit_code == 0:
         print(f"\n✅ Tests in {test_path} passed!")
-        return 0
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ Tests in {test_path} failed with exit code {e.returncode}")
-        return e.returncode
+    else:
+        print(f"\n❌ Tests in {test_path} failed with exit code {exit_code}")
+    return exit_code
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
+    # --subprocess runs pytest in a separate interpreter instead of this one
+    argv = sys.argv[1:]
+    use_subprocess = "--subprocess" in argv
+    argv = [arg for arg in argv if arg != "--subprocess"]
+    
+    if argv:
         # Run specific test file
-        test_path = sys.argv[1]
-        exit_code = run_specific_tests(test_path)
+        test_path = argv[0]
+        exit_code = run_specific_tests(test_path, use_subprocess)
     else:
         # Run all tests
-        exit_code = run_tests()
+        exit_code = run_tests(use_subprocess)
     
     sys.exit(exit_code)
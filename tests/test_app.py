@@ -5,29 +5,24 @@ Tests for Flask application
 import pytest
 import json
 import os
+import shutil
 from unittest.mock import patch
 from PIL import Image
 import numpy as np
+from flask import jsonify
 from app import app
 from media_processor.registry import MediaRegistry
 
 
-@pytest.fixture
-def client(temp_dir):
-    """Create a test client with isolated test environment"""
-    # Create test registry file
-    test_registry_file = os.path.join(temp_dir, "test_registry.json")
-    test_data = []
-    with open(test_registry_file, 'w') as f:
-        json.dump(test_data, f)
-    
-    # Temporarily patch the global app_state to use test files
-    from media_processor.registry import MediaRegistry
+@pytest.fixture(scope="module")
+def _app_env(tmp_path_factory):
+    """Build the isolated registry, media processor and patched app state once per module"""
     from media_processor.media_processor import MediaProcessor
     import app as app_module
     
-    # Store original app_state
-    original_app_state = app_module.app_state
+    # Create test registry file
+    temp_dir = str(tmp_path_factory.mktemp("app"))
+    test_registry_file = os.path.join(temp_dir, "test_registry.json")
     
     # Create test instances
     test_registry = MediaRegistry(test_registry_file)
@@ -36,29 +31,71 @@ def client(temp_dir):
     # Create new app_state with test instances
     class TestAppState:
         def __init__(self):
+            self.reset()
+        
+        def reset(self):
+            """Point back at the test registry, undoing any registry switch made by the previous test"""
             self.current_registry_path = test_registry_file
             self.registry = test_registry
             self.media_processor = test_media_processor
         
+        @property
+        def bundle(self):
+            """Stand in for the RegistryBundle; the test state carries the same component attributes"""
+            return self
+        
+        @property
+        def registry_path(self):
+            return self.current_registry_path
+        
         def update_registry(self, registry_path: str):
             self.current_registry_path = registry_path
             self.registry = MediaRegistry(registry_path)
             self.media_processor = MediaProcessor(registry_path)
     
-    # Patch the global app_state
+    # Store original app_state and patch the global one
+    original_app_state = app_module.app_state
     app_module.app_state = TestAppState()
     
     # Mock the config functions to prevent any real config file access
-    with patch('config.get_last_registry_path', return_value=test_registry_file), \
-         patch('config.save_last_registry_path', return_value=True):
-        
-        with app.test_client() as client:
-            yield client
+    config_patches = [
+        patch('config.get_last_registry_path', return_value=test_registry_file),
+        patch('config.save_last_registry_path', return_value=True),
+    ]
+    for config_patch in config_patches:
+        config_patch.start()
+    
+    yield app_module.app_state
     
+    for config_patch in reversed(config_patches):
+        config_patch.stop()
     # Restore original app_state
     app_module.app_state = original_app_state
 
 
+@pytest.fixture
+def app_dir(_app_env):
+    """Directory holding the test registry and its media folder"""
+    return os.path.dirname(_app_env.current_registry_path)
+
+
+@pytest.fixture
+def client(_app_env):
+    """Create a test client with an empty registry and media folder"""
+    _app_env.reset()
+    with open(_app_env.current_registry_path, 'w') as f:
+        f.write("[]")
+    _app_env.registry.load()
+    
+    upload_folder = _app_env.media_processor.upload_folder
+    shutil.rmtree(upload_folder, ignore_errors=True)
+    os.makedirs(upload_folder)
+    
+    # A fresh client per test keeps session cookies from leaking between tests
+    with app.test_client() as client:
+        yield client
+
+
 @pytest.fixture
 def test_image_file(temp_dir):
     """Create a test image file in temporary directory"""
@@ -102,6 +139,23 @@ class TestAppRoutes:
         assert response.status_code == 200
         assert b'Tag By Image' in response.data
     
+    def test_static_pages_rendered_once(self, client):
+        """Test that static pages are cached per template and keep their own active nav link"""
+        import app as app_module
+        
+        with patch.dict(app_module.static_pages, clear=True), \
+             patch('app.render_template', wraps=app_module.render_template) as mock_render:
+            first = client.get('/tag-manager')
+            second = client.get('/tag-manager/')
+            other = client.get('/tag-by-tag')
+            
+            assert mock_render.call_count == 2
+        
+        assert first.data == second.data
+        assert b'href="/tag-manager" class="active"' in first.data
+        assert b'href="/tag-by-tag" class="active"' in other.data
+        assert client.options('/tag-manager').status_code == 405
+    
     def test_media_list_api(self, client):
         """Test media list API"""
         response = client.get('/api/media')
@@ -110,10 +164,51 @@ class TestAppRoutes:
         data = json.loads(response.data)
         assert isinstance(data, list)
     
-    def test_media_info_api_valid_index(self, client, temp_dir):
+    def test_json_responses_match_flask_encoding(self):
+        """Test that API responses keep Flask's JSON output when encoded with orjson"""
+        import app as app_module
+        if not app_module.ORJSON_AVAILABLE:
+            pytest.skip("orjson not installed")
+        
+        assert isinstance(app.json, app_module.ORJSONProvider)
+        with app.test_request_context():
+            response = jsonify({'b': [1, 2], 'a': {1: 'one'}, 'path': 'events/é.png'})
+        
+        assert response.mimetype == 'application/json'
+        assert json.loads(response.data) == {'a': {'1': 'one'}, 'b': [1, 2], 'path': 'events/é.png'}
+        assert response.data.index(b'"a"') < response.data.index(b'"b"')
+        
+        # Positional and keyword forms follow jsonify's rules
+        with app.test_request_context():
+            assert json.loads(jsonify(1, 2).data) == [1, 2]
+            assert json.loads(jsonify(a=1).data) == {'a': 1}
+            assert json.loads(jsonify().data) is None
+            with pytest.raises(TypeError):
+                jsonify(1, a=1)
+    
+    def test_media_list_api_conditional_request(self, client):
+        """Test that the media list and count return 304 until the registry changes"""
+        import app as app_module
+        
+        for url in ('/api/media', '/api/media/count'):
+            response = client.get(url)
+            assert response.status_code == 200
+            etag = response.headers['ETag']
+            
+            response = client.get(url, headers={'If-None-Match': etag})
+            assert response.status_code == 304
+            assert response.data == b''
+        
+        app_module.app_state.registry.add_media("events/new.png")
+        
+        response = client.get('/api/media', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert json.loads(response.data) == [{"path": "events/new.png"}]
+    
+    def test_media_info_api_valid_index(self, client, app_dir):
         """Test media info API with valid index"""
         # Add test media to the temporary registry
-        test_registry_file = os.path.join(temp_dir, "test_registry.json")
+        test_registry_file = os.path.join(app_dir, "test_registry.json")
         test_data = [
             {"path": "events/test1.png"},
             {"path": "events/test2.mp4"}
@@ -195,9 +290,9 @@ class TestAppRoutes:
         assert 'error' in data
         assert 'Registry path cannot be empty' in data['error']
     
-    def test_serve_media(self, client, temp_dir):
+    def test_serve_media(self, client, app_dir):
         """Test serving media files"""
-        test_media_dir = os.path.join(temp_dir, "events")
+        test_media_dir = os.path.join(app_dir, "events")
         os.makedirs(test_media_dir, exist_ok=True)
         test_file = os.path.join(test_media_dir, 'test.jpg')
         with open(test_file, 'w') as f:
@@ -207,10 +302,24 @@ class TestAppRoutes:
         assert response.status_code == 200
         assert response.data == b'test content'
     
-    def test_delete_media_api_success(self, client, temp_dir):
+    def test_serve_media_conditional_request(self, client, app_dir):
+        """Test that served media can be revalidated with an ETag"""
+        test_media_dir = os.path.join(app_dir, "events")
+        os.makedirs(test_media_dir, exist_ok=True)
+        with open(os.path.join(test_media_dir, 'cached.jpg'), 'w') as f:
+            f.write('cached content')
+        
+        response = client.get('/events/cached.jpg')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        
+        response = client.get('/events/cached.jpg', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+    
+    def test_delete_media_api_success(self, client, app_dir):
         """Test successful media deletion"""
         # Create a test file in the test media directory
-        test_media_dir = os.path.join(temp_dir, "events")
+        test_media_dir = os.path.join(app_dir, "events")
         os.makedirs(test_media_dir, exist_ok=True)
         test_file = os.path.join(test_media_dir, "test_delete.jpg")
         with open(test_file, 'w') as f:
@@ -347,3 +456,200 @@ class TestUploadAPI:
         data = json.loads(response.data)
         assert 'error' in data
         assert 'Failed to process video' in data['error']
+    
+    def test_upload_leaves_no_partial_file(self, client, temp_dir, app_dir):
+        """Test that the partial upload in the media folder is removed after processing"""
+        img_array = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+        img = Image.fromarray(img_array)
+        img_path = os.path.join(temp_dir, 'partial.jpg')
+        img.save(img_path)
+        
+        with open(img_path, 'rb') as f:
+            response = client.post('/api/upload', data={'file': (f, 'partial.jpg')})
+        
+        assert response.status_code == 200
+        assert os.listdir(os.path.join(app_dir, 'events')) == ['partial.jpg']
+    
+    def test_upload_duplicate_skips_processing(self, client, temp_dir):
+        """Test that a duplicate upload is rejected before any media processing"""
+        img_array = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+        img = Image.fromarray(img_array)
+        img_path = os.path.join(temp_dir, 'dup.jpg')
+        img.save(img_path)
+        
+        with open(img_path, 'rb') as f:
+            response = client.post('/api/upload', data={'file': (f, 'dup.jpg')})
+        assert response.status_code == 200
+        
+        import app as app_module
+        with patch.object(app_module.app_state.media_processor, 'process_media_file') as mock_process:
+            with open(img_path, 'rb') as f:
+                response = client.post('/api/upload', data={'file': (f, 'dup.jpg')})
+            mock_process.assert_not_called()
+        
+        assert response.status_code == 409
+        data = json.loads(response.data)
+        assert data['is_duplicate'] is True
+        assert data['duplicate_info']['index'] == 0
+    
+    def test_upload_duplicate_of_legacy_hash(self, client, temp_dir):
+        """Test that uploads match entries hashed with the legacy algorithm and migrate them"""
+        import hashlib
+        import app as app_module
+        
+        img_array = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+        img = Image.fromarray(img_array)
+        img_path = os.path.join(temp_dir, 'legacy.jpg')
+        img.save(img_path)
+        
+        with open(img_path, 'rb') as f:
+            legacy_hash = hashlib.md5(f.read()).hexdigest()
+        app_module.app_state.registry.add_media("events/legacy.jpg", legacy_hash)
+        
+        # The legacy digest is computed while the upload is saved, not by re-reading the file
+        with open(img_path, 'rb') as f, \
+             patch('media_processor.file_utils.FileUtils.calculate_file_hash') as mock_hash:
+            response = client.post('/api/upload', data={'file': (f, 'legacy.jpg')})
+            mock_hash.assert_not_called()
+        
+        assert response.status_code == 409
+        data = json.loads(response.data)
+        assert data['duplicate_info']['path'] == "events/legacy.jpg"
+        
+        # The entry should now carry the current hash
+        entry = app_module.app_state.registry.get_media_by_index(0)
+        assert entry['original_hash'] != legacy_hash
+        assert not app_module.app_state.registry.has_legacy_hashes()
+
+    
+    def test_upload_in_background(self, client, temp_dir):
+        """Test that a background upload returns a job id that reports the result"""
+        import app as app_module
+        
+        img_array = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+        img = Image.fromarray(img_array)
+        img_path = os.path.join(temp_dir, 'background.jpg')
+        img.save(img_path)
+        
+        with open(img_path, 'rb') as f:
+            response = client.post('/api/upload?background=1', data={'file': (f, 'background.jpg')})
+        
+        assert response.status_code == 202
+        job_id = json.loads(response.data)['job_id']
+        
+        # Wait for the worker to finish before polling
+        app_module.upload_jobs[job_id].result(timeout=30)
+        
+        response = client.get(f'/api/jobs/{job_id}')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['status'] == 'done'
+        assert data['success'] is True
+        assert data['path'].endswith('.jpg')
+        assert len(app_module.app_state.registry.get_all_media()) == 1
+    
+    def test_same_named_background_uploads(self, client, temp_dir):
+        """Test that two queued uploads with the same name are stored under distinct names"""
+        import threading
+        import app as app_module
+        from media_processor.image_processor import ImageProcessor
+        
+        paths = []
+        for i in range(2):
+            img_array = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+            img_path = os.path.join(temp_dir, f'upload{i}.jpg')
+            Image.fromarray(img_array).save(img_path)
+            paths.append(img_path)
+        
+        # Hold both conversions until each has picked its output name
+        both_converting = threading.Barrier(2, timeout=10)
+        original_resize = ImageProcessor.resize_image
+        
+        def resize_together(input_path, output_path):
+            both_converting.wait()
+            return original_resize(input_path, output_path)
+        
+        with patch.object(ImageProcessor, 'resize_image', side_effect=resize_together):
+            job_ids = []
+            for img_path in paths:
+                with open(img_path, 'rb') as f:
+                    response = client.post('/api/upload?background=1', data={'file': (f, 'image.jpg')})
+                assert response.status_code == 202
+                job_ids.append(json.loads(response.data)['job_id'])
+            results = [app_module.upload_jobs[job_id].result(timeout=30) for job_id in job_ids]
+        
+        assert [status for _, status in results] == [200, 200]
+        stored = sorted(result['path'] for result, _ in results)
+        assert stored == ['events/image-1.jpg', 'events/image.jpg']
+        for path in stored:
+            assert os.path.exists(app_module.app_state.media_processor.get_media_path(path))
+        assert sorted(entry['path'] for entry in app_module.app_state.registry.get_all_media()) == stored
+    
+    def test_get_unknown_job(self, client):
+        """Test that polling an unknown job returns 404"""
+        response = client.get('/api/jobs/missing')
+        assert response.status_code == 404
+
+
+class TestAppState:
+    """Test global application state management"""
+    
+    def test_update_registry_swaps_all_components(self, temp_dir):
+        """Test that switching registry replaces every component together"""
+        import app as app_module
+        
+        first_registry = os.path.join(temp_dir, "first", "events_registry.json")
+        second_registry = os.path.join(temp_dir, "second", "events_registry.json")
+        
+        with patch('app.get_last_registry_path', return_value=first_registry), \
+             patch('app.save_last_registry_path', return_value=True) as mock_save:
+            state = app_module.AppState()
+            assert state.current_registry_path == first_registry
+            
+            state.update_registry(second_registry)
+            mock_save.assert_called_once_with(second_registry)
+        
+        assert state.current_registry_path == second_registry
+        assert state.registry.registry_file == second_registry
+        assert state.media_processor.registry_path == second_registry
+        assert state.tag_registry.media_registry_path == second_registry
+        assert state.media_processor.upload_folder == os.path.join(temp_dir, "second", "events")
+    
+    def test_processors_built_on_first_use(self, temp_dir):
+        """Test that the media processor and tag registry are only built when accessed"""
+        import app as app_module
+        
+        registry_path = os.path.join(temp_dir, "events_registry.json")
+        bundle = app_module.RegistryBundle.for_path(registry_path)
+        assert not os.path.exists(os.path.join(temp_dir, "events"))
+        
+        media_processor = bundle.media_processor
+        assert media_processor is bundle.media_processor
+        assert os.path.isdir(os.path.join(temp_dir, "events"))
+        assert bundle.tag_registry.media_registry_path == registry_path
+    
+    def test_delete_media_stays_on_one_registry_during_switch(self, temp_dir):
+        """Test that a registry switch mid-delete can't remove the index from the other registry"""
+        import app as app_module
+        
+        first_registry = os.path.join(temp_dir, "first", "events_registry.json")
+        second_registry = os.path.join(temp_dir, "second", "events_registry.json")
+        MediaRegistry(first_registry).add_media("events/first.jpg")
+        MediaRegistry(second_registry).add_media("events/second.jpg")
+        
+        with patch('app.get_last_registry_path', return_value=first_registry), \
+             patch('app.save_last_registry_path', return_value=True):
+            state = app_module.AppState()
+            
+            def remove_and_switch(path):
+                # Another request switches registries while this one is deleting
+                state.update_registry(second_registry)
+                raise FileNotFoundError(path)
+            
+            with patch.object(app_module, 'app_state', state), \
+                 patch('app.os.remove', side_effect=remove_and_switch):
+                response = app.test_client().delete('/api/media/0')
+        
+        assert response.status_code == 200
+        assert MediaRegistry(first_registry).get_all_media() == []
+        assert MediaRegistry(second_registry).get_all_media() == [{'path': 'events/second.jpg'}]
@@ -19,6 +19,10 @@ from config import (
 from media_processor.config import (
     SUPPORTED_INPUT_FORMATS,
     SUPPORTED_OUTPUT_FORMATS,
+    EXT_TO_TYPE,
+    JPEG_QUALITY,
+    VIDEO_CRF_WEBM,
+    get_encode_params,
     LANDSCAPE_TARGET_WIDTH,
     PORTRAIT_TARGET_HEIGHT,
     SQUARE_TARGET_SIZE
@@ -36,6 +40,13 @@ class TestConfig:
         assert '.jpg' in SUPPORTED_INPUT_FORMATS['image']
         assert '.mp4' in SUPPORTED_INPUT_FORMATS['video']
     
+    def test_ext_to_type(self):
+        """Test the extension lookup covers every supported input format"""
+        assert EXT_TO_TYPE['.jpg'] == 'image'
+        assert EXT_TO_TYPE['.webp'] == 'image'
+        assert EXT_TO_TYPE['.mkv'] == 'video'
+        assert set(EXT_TO_TYPE) == SUPPORTED_INPUT_FORMATS['image'] | SUPPORTED_INPUT_FORMATS['video']
+    
     def test_supported_output_formats(self):
         """Test supported output formats"""
         assert '.webm' in SUPPORTED_OUTPUT_FORMATS
@@ -43,6 +54,37 @@ class TestConfig:
         assert '.jpg' in SUPPORTED_OUTPUT_FORMATS
         assert '.gif' not in SUPPORTED_OUTPUT_FORMATS  # GIF removed from output formats
     
+    def test_get_encode_params(self):
+        """Test encoder options are looked up by file type and output extension"""
+        assert get_encode_params('image', '.jpg') == {'format': 'JPEG', 'quality': JPEG_QUALITY,
+                                                      'optimize': True, 'progressive': True}
+        assert get_encode_params('image', '.png') == {'format': 'PNG'}
+        assert get_encode_params('video', '.webm')['crf'] == VIDEO_CRF_WEBM
+        assert get_encode_params('image', '.bmp') == {}
+    
+    def test_json_helpers_match_with_and_without_orjson(self):
+        """Test that config JSON is written identically whether or not orjson is installed"""
+        import config
+        data = {'last_registry_path': '/test/path/événements/registry.json'}
+        
+        encoded = config.dumps_json(data)
+        with patch('config.ORJSON_AVAILABLE', False):
+            assert config.dumps_json(data) == encoded
+            assert config.loads_json(encoded) == data
+        assert config.loads_json(encoded) == data
+    
+    def test_load_json_file(self, temp_dir):
+        """Test that JSON files load the same with and without orjson"""
+        import config
+        data = [{'path': 'events/file1.jpg', 'tags': {'count': 3}}]
+        json_path = os.path.join(temp_dir, 'registry.json')
+        with open(json_path, 'wb') as f:
+            f.write(config.dumps_json(data))
+        
+        assert config.load_json_file(json_path) == data
+        with patch('config.ORJSON_AVAILABLE', False):
+            assert config.load_json_file(json_path) == data
+    
     def test_dimension_constants(self):
         """Test dimension constants"""
         assert LANDSCAPE_TARGET_WIDTH == 1024
@@ -71,6 +113,13 @@ class TestCalculateDimensions:
         assert width == SQUARE_TARGET_SIZE  # 576
         assert height == SQUARE_TARGET_SIZE  # 576
     
+    def test_calculate_dimensions_exact_ratio(self):
+        """Test that exact proportional sizes are not truncated by float rounding"""
+        # 1024 * 99 / 128 is exactly 792
+        assert FileUtils.calculate_dimensions(128, 99) == (1024, 792)
+        assert FileUtils.calculate_dimensions(99, 128) == (445, 576)
+        assert FileUtils.calculate_dimensions(128, 99, ensure_even=True) == (1024, 792)
+    
     def test_calculate_dimensions_with_even_ensurance(self):
         """Test dimension calculation with even number enforcement"""
         width, height = FileUtils.calculate_dimensions(1001, 1001)
@@ -120,9 +169,15 @@ class TestMediaFolderFunctions:
 class TestPersistentRegistryPath:
     """Test persistent registry path functionality"""
     
+    @pytest.fixture(autouse=True)
+    def reset_saved_path(self):
+        """Forget the registry path remembered by earlier tests"""
+        with patch('config._last_saved_registry_path', None):
+            yield
+    
     def test_get_last_registry_path_no_config_file(self):
         """Test getting last registry path when config file doesn't exist"""
-        with patch('os.path.exists', return_value=False):
+        with patch('builtins.open', side_effect=FileNotFoundError(CONFIG_FILE)):
             result = get_last_registry_path()
             assert result == DEFAULT_REGISTRY_FILE
     
@@ -130,22 +185,19 @@ class TestPersistentRegistryPath:
         """Test getting last registry path from valid config file"""
         config_data = {'last_registry_path': '/test/path/registry.json'}
         
-        # Mock os.path.exists to return True for config file and the registry file
-        def mock_exists(path):
-            return path == CONFIG_FILE or path == '/test/path/registry.json'
-        
-        with patch('os.path.exists', side_effect=mock_exists), \
+        # The registry file exists, so stat succeeds
+        with patch('os.stat') as mock_stat, \
              patch('builtins.open', mock_open(read_data=json.dumps(config_data))):
             
             result = get_last_registry_path()
             assert result == '/test/path/registry.json'
+            mock_stat.assert_called_once_with('/test/path/registry.json')
     
     def test_get_last_registry_path_missing_key(self):
         """Test getting last registry path when config file has no registry path"""
         config_data = {'other_key': 'value'}
         
-        with patch('os.path.exists', return_value=True), \
-             patch('builtins.open', mock_open(read_data=json.dumps(config_data))):
+        with patch('builtins.open', mock_open(read_data=json.dumps(config_data))):
             
             result = get_last_registry_path()
             assert result == DEFAULT_REGISTRY_FILE
@@ -154,10 +206,8 @@ class TestPersistentRegistryPath:
         """Test getting last registry path when saved registry doesn't exist"""
         config_data = {'last_registry_path': '/nonexistent/registry.json'}
         
-        def mock_exists(path):
-            return path == CONFIG_FILE  # Only config file exists, not the registry
-        
-        with patch('os.path.exists', side_effect=mock_exists), \
+        # Only the config file exists, not the registry
+        with patch('os.stat', side_effect=FileNotFoundError('/nonexistent/registry.json')), \
              patch('builtins.open', mock_open(read_data=json.dumps(config_data))):
             
             result = get_last_registry_path()
@@ -165,8 +215,7 @@ class TestPersistentRegistryPath:
     
     def test_get_last_registry_path_corrupted_config(self):
         """Test getting last registry path when config file is corrupted"""
-        with patch('os.path.exists', return_value=True), \
-             patch('builtins.open', mock_open(read_data='invalid json')):
+        with patch('builtins.open', mock_open(read_data='invalid json')):
             
             result = get_last_registry_path()
             assert result == DEFAULT_REGISTRY_FILE
@@ -176,18 +225,30 @@ class TestPersistentRegistryPath:
         registry_path = '/test/path/registry.json'
         
         mock_file = mock_open()
-        with patch('builtins.open', mock_file):
+        with patch('builtins.open', mock_file), patch('os.replace') as mock_replace:
             result = save_last_registry_path(registry_path)
             
             assert result is True
-            mock_file.assert_called_once_with(CONFIG_FILE, 'w')
+            mock_file.assert_called_once_with(f'{CONFIG_FILE}.tmp', 'wb')
+            mock_replace.assert_called_once_with(f'{CONFIG_FILE}.tmp', CONFIG_FILE)
             
             # Verify the correct JSON was written
             written_calls = mock_file().write.call_args_list
-            written_data = ''.join(call[0][0] for call in written_calls)
-            expected_data = json.dumps({'last_registry_path': registry_path}, indent=2)
+            written_data = b''.join(call[0][0] for call in written_calls)
+            expected_data = json.dumps({'last_registry_path': registry_path}, indent=2).encode()
             assert written_data == expected_data
     
+    def test_save_last_registry_path_unchanged(self):
+        """Test that saving the path already in the config file skips the write"""
+        registry_path = '/test/path/registry.json'
+        
+        mock_file = mock_open()
+        with patch('builtins.open', mock_file), patch('os.replace'):
+            assert save_last_registry_path(registry_path) is True
+            assert save_last_registry_path(registry_path) is True
+            
+            mock_file.assert_called_once()
+    
     def test_save_last_registry_path_failure(self):
         """Test saving registry path when file write fails"""
         registry_path = '/test/path/registry.json'
@@ -199,6 +260,6 @@ class TestPersistentRegistryPath:
     def test_save_last_registry_path_invalid_path(self):
         """Test saving registry path with invalid path that can't be JSON encoded"""
         # This is a bit contrived, but tests the JSON encoding error handling
-        with patch('json.dump', side_effect=TypeError("Object not serializable")):
+        with patch('config.dumps_json', side_effect=TypeError("Object not serializable")):
             result = save_last_registry_path("test")
             assert result is False
@@ -4,6 +4,7 @@ Tests for file utilities module
 
 import pytest
 import os
+from unittest.mock import patch, mock_open
 from media_processor.file_utils import FileUtils
 
 
@@ -69,6 +70,8 @@ class TestFileUtils:
         assert FileUtils.get_file_type("test.doc") is None
         assert FileUtils.get_file_type("test") is None
         assert FileUtils.get_file_type("") is None
+        assert FileUtils.get_file_type(".jpg") is None  # Hidden file without an extension
+        assert FileUtils.get_file_type("photo.jpg.txt") is None
     
     def test_get_file_type_case_insensitive(self):
         """Test file type detection is case insensitive"""
@@ -172,12 +175,71 @@ class TestFileUtils:
         
         assert FileUtils.is_animated_webp(static_webp_path) is False
     
+    def test_animation_check_cached_per_file_version(self, temp_dir):
+        """Test that a GIF is only opened again once the file changes"""
+        from PIL import Image
+        import numpy as np
+        
+        gif_path = os.path.join(temp_dir, "cached.gif")
+        frames = [Image.fromarray(np.full((20, 20, 3), value, dtype=np.uint8)) for value in (0, 255)]
+        frames[0].save(gif_path)
+        
+        from media_processor import file_utils
+        with patch('media_processor.file_utils._read_animation_flag',
+                   wraps=file_utils._read_animation_flag) as mock_read:
+            assert FileUtils.is_animated_gif(gif_path) is False
+            assert FileUtils.classify("cached.gif", gif_path) == ('image', '.png')
+            assert mock_read.call_count == 1
+            
+            frames[0].save(gif_path, save_all=True, append_images=frames[1:])
+            assert FileUtils.classify("cached.gif", gif_path) == ('video', '.webm')
+            assert mock_read.call_count == 2
+    
+    def test_animation_check_reads_headers(self, temp_dir):
+        """Test that animation is detected from GIF/WebP headers without opening the image in PIL"""
+        from PIL import Image
+        import numpy as np
+        
+        frames = [Image.fromarray(np.random.randint(0, 255, (40, 50, 3), dtype=np.uint8)) for _ in range(3)]
+        paths = {name: os.path.join(temp_dir, name)
+                 for name in ("static.gif", "animated.gif", "static.webp", "lossless.webp", "animated.webp")}
+        frames[0].save(paths["static.gif"])
+        frames[0].save(paths["animated.gif"], save_all=True, append_images=frames[1:])
+        frames[0].save(paths["static.webp"])
+        frames[0].save(paths["lossless.webp"], lossless=True)
+        frames[0].save(paths["animated.webp"], save_all=True, append_images=frames[1:])
+        
+        with patch('PIL.Image.open') as mock_open_image:
+            assert FileUtils.is_animated_gif(paths["static.gif"]) is False
+            assert FileUtils.is_animated_gif(paths["animated.gif"]) is True
+            assert FileUtils.is_animated_webp(paths["static.webp"]) is False
+            assert FileUtils.is_animated_webp(paths["lossless.webp"]) is False
+            assert FileUtils.is_animated_webp(paths["animated.webp"]) is True
+            mock_open_image.assert_not_called()
+    
+    def test_animation_check_falls_back_to_pil(self, temp_dir):
+        """Test that files with an unrecognized header are checked with PIL"""
+        bad_path = os.path.join(temp_dir, "truncated.gif")
+        with open(bad_path, 'wb') as f:
+            f.write(b"GIF89a")
+        
+        assert FileUtils.is_animated_gif(bad_path) is False
+    
+    def test_classify(self):
+        """Test classifying file type and output format together"""
+        assert FileUtils.classify("test.jpg") == ('image', '.jpg')
+        assert FileUtils.classify("test.bmp") == ('image', '.png')
+        assert FileUtils.classify("test.mov") == ('video', '.webm')
+        assert FileUtils.classify("test.gif") == ('image', '.png')
+        assert FileUtils.classify("test.txt") == (None, None)
+    
     def test_create_output_filename(self):
         """Test output filename creation"""
         assert FileUtils.create_output_filename("test.jpg", ".png") == "test.png"
         assert FileUtils.create_output_filename("image.bmp", ".jpg") == "image.jpg"
         assert FileUtils.create_output_filename("video.avi", ".webm") == "video.webm"
         assert FileUtils.create_output_filename("file", ".png") == "file.png"
+        assert FileUtils.create_output_filename("media/archive.tar.gz", ".png") == "archive.tar.png"
     
     def test_normalize_path(self):
         """Test path normalization"""
@@ -209,6 +271,20 @@ class TestFileUtils:
         assert size > 0
         assert isinstance(size, int)
     
+    def test_scan_directory(self, temp_dir):
+        """Test scanning a directory for supported media files"""
+        for name, content in (("photo.JPG", b"1234"), ("clip.mp4", b"12"), ("notes.txt", b"x")):
+            with open(os.path.join(temp_dir, name), 'wb') as f:
+                f.write(content)
+        os.makedirs(os.path.join(temp_dir, "folder.png"))
+        
+        results = sorted(FileUtils.scan_directory(temp_dir))
+        
+        assert results == [
+            (os.path.join(temp_dir, "clip.mp4"), "clip.mp4", ".mp4", "video", 2),
+            (os.path.join(temp_dir, "photo.JPG"), "photo.JPG", ".jpg", "image", 4),
+        ]
+    
     def test_format_file_size(self):
         """Test file size formatting"""
         assert FileUtils.format_file_size(0) == "0 B"
@@ -227,7 +303,13 @@ class TestFileUtils:
         
         # Calculate hash
         hash1 = FileUtils.calculate_file_hash(test_file)
-        assert len(hash1) == 32  # MD5 hash is 32 characters
+        assert len(hash1) == 40  # 20-byte BLAKE2b hash is 40 characters
+        assert not FileUtils.is_legacy_hash(hash1)
+        
+        # Legacy MD5 hashes can still be calculated for migration
+        legacy_hash = FileUtils.calculate_file_hash(test_file, 'md5')
+        assert len(legacy_hash) == 32
+        assert FileUtils.is_legacy_hash(legacy_hash)
         
         # Same content should produce same hash
         hash2 = FileUtils.calculate_file_hash(test_file)
@@ -245,3 +327,93 @@ class TestFileUtils:
         assert "KB" in FileUtils.format_file_size(1500)
         assert "MB" in FileUtils.format_file_size(1500000)
         assert "GB" in FileUtils.format_file_size(1500000000)
+    
+    def test_calculate_file_hash_large_file(self, temp_dir):
+        """Test that files spanning many reads hash the same with and without file_digest"""
+        import hashlib
+        from types import SimpleNamespace
+        
+        content = os.urandom(3 * 1024 * 1024 + 17)
+        test_file = os.path.join(temp_dir, "large.bin")
+        with open(test_file, "wb") as f:
+            f.write(content)
+        
+        expected = hashlib.blake2b(content, digest_size=20).hexdigest()
+        assert FileUtils.calculate_file_hash(test_file) == expected
+        
+        # Without hashlib.file_digest (Python < 3.11) the chunked fallback is used
+        without_file_digest = SimpleNamespace(blake2b=hashlib.blake2b, new=hashlib.new)
+        with patch('media_processor.file_utils.hashlib', without_file_digest):
+            assert FileUtils.calculate_file_hash(test_file) == expected
+        assert FileUtils.calculate_file_hash(test_file, 'md5') == hashlib.md5(content).hexdigest()
+    
+    def test_hash_files(self, temp_dir):
+        """Test that hashing a batch of files matches hashing them one at a time"""
+        paths = []
+        for i in range(6):
+            path = os.path.join(temp_dir, f"file{i}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(1024 * (i + 1)))
+            paths.append(path)
+        missing = os.path.join(temp_dir, "missing.bin")
+        
+        hashes = FileUtils.hash_files(paths + [missing])
+        assert hashes == {path: FileUtils.calculate_file_hash(path) for path in paths + [missing]}
+        assert hashes[missing] == ""
+        assert FileUtils.hash_files(paths, 'md5', max_workers=1) == {
+            path: FileUtils.calculate_file_hash(path, 'md5') for path in paths
+        }
+        assert FileUtils.hash_files([]) == {}
+    
+    def test_save_stream_with_hash(self, temp_dir):
+        """Test streaming a file to disk while hashing it"""
+        from io import BytesIO
+        
+        content = b"streamed content" * 1000
+        output_path = os.path.join(temp_dir, "streamed.bin")
+        
+        stream_hash = FileUtils.save_stream_with_hash(BytesIO(content), output_path)
+        
+        # The written file should match the stream and hash to the same value
+        with open(output_path, "rb") as f:
+            assert f.read() == content
+        assert stream_hash == FileUtils.calculate_file_hash(output_path)
+    
+    def test_save_stream_with_hash_extra_hasher(self, temp_dir):
+        """Test that an extra hasher is fed the same bytes in the same pass"""
+        import hashlib
+        from io import BytesIO
+        
+        content = b"legacy content" * 1000
+        output_path = os.path.join(temp_dir, "legacy.bin")
+        legacy_hash = hashlib.md5()
+        
+        stream_hash = FileUtils.save_stream_with_hash(BytesIO(content), output_path, legacy_hash)
+        
+        assert stream_hash == FileUtils.calculate_file_hash(output_path)
+        assert legacy_hash.hexdigest() == hashlib.md5(content).hexdigest()
+    
+    def test_save_stream_with_hash_many_chunks(self, temp_dir):
+        """Test that chunks queued for the writer thread arrive in order"""
+        from io import BytesIO
+        
+        content = bytes(range(256)) * 64
+        output_path = os.path.join(temp_dir, "chunked.bin")
+        
+        with patch('media_processor.file_utils.FILE_CHUNK_SIZE', 100):
+            stream_hash = FileUtils.save_stream_with_hash(BytesIO(content), output_path)
+        
+        with open(output_path, "rb") as f:
+            assert f.read() == content
+        assert stream_hash == FileUtils.calculate_file_hash(output_path)
+    
+    def test_save_stream_with_hash_write_error(self, temp_dir):
+        """Test that a failed write is raised instead of returning a hash"""
+        from io import BytesIO
+        
+        mock_file = mock_open()
+        mock_file().write.side_effect = OSError("No space left on device")
+        with patch('builtins.open', mock_file), \
+             patch('media_processor.file_utils.FILE_CHUNK_SIZE', 10):
+            with pytest.raises(OSError, match="No space left"):
+                FileUtils.save_stream_with_hash(BytesIO(b"x" * 1000), os.path.join(temp_dir, "full.bin"))
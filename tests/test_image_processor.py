@@ -130,6 +130,51 @@ class TestImageProcessor:
         with Image.open(output_path) as output_img:
             assert output_img.mode == 'RGB'
     
+    def test_resize_large_jpeg(self, temp_dir):
+        """Test that large JPEGs decoded at reduced scale still come out at the exact target size"""
+        input_path = os.path.join(temp_dir, "large.jpg")
+        output_path = os.path.join(temp_dir, "output.jpg")
+        
+        # 4000x2250 decodes at 1/2 scale (2000x1125) before resizing to 1024x576
+        img_array = np.random.randint(0, 255, (2250, 4000, 3), dtype=np.uint8)
+        Image.fromarray(img_array).save(input_path, 'JPEG')
+        
+        result = ImageProcessor.resize_image(input_path, output_path)
+        
+        assert result is True
+        with Image.open(output_path) as output_img:
+            assert output_img.size == (1024, 576)
+            assert output_img.mode == 'RGB'
+    
+    def test_resize_large_png(self, temp_dir):
+        """Test that large non-JPEG images reduced before the Lanczos pass come out at the exact target size"""
+        input_path = os.path.join(temp_dir, "large.png")
+        output_path = os.path.join(temp_dir, "output.png")
+        
+        img_array = np.random.randint(0, 255, (2000, 3600, 3), dtype=np.uint8)
+        Image.fromarray(img_array).save(input_path)
+        
+        result = ImageProcessor.resize_image(input_path, output_path)
+        
+        assert result is True
+        with Image.open(output_path) as output_img:
+            assert output_img.size == (1024, 568)
+    
+    def test_resize_image_grayscale_alpha(self, temp_dir):
+        """Test that grayscale images with alpha lose the alpha channel but stay grayscale"""
+        input_path = os.path.join(temp_dir, "input_la.png")
+        output_path = os.path.join(temp_dir, "output_l.jpg")
+        
+        img_array = np.random.randint(0, 255, (100, 150), dtype=np.uint8)
+        Image.fromarray(img_array).convert('LA').save(input_path)
+        
+        result = ImageProcessor.resize_image(input_path, output_path)
+        
+        assert result is True
+        with Image.open(output_path) as output_img:
+            assert output_img.mode == 'L'
+            assert output_img.size == (1024, 682)
+    
     def test_resize_image_failure(self, temp_dir):
         """Test image resizing failure"""
         # Try to resize non-existent file
@@ -4,9 +4,11 @@ Tests for main media processor module
 
 import pytest
 import os
+from unittest.mock import patch
 from PIL import Image
 import numpy as np
 from media_processor.media_processor import MediaProcessor
+from media_processor.image_processor import ImageProcessor
 
 
 class TestMediaProcessor:
@@ -23,6 +25,16 @@ class TestMediaProcessor:
         processor = MediaProcessor(custom_registry)
         expected_media_folder = os.path.join(temp_dir, "events")
         assert processor.upload_folder == expected_media_folder
+        assert processor.upload_folder_name == "events"
+    
+    def test_get_media_path(self, temp_dir):
+        """Test resolving a registry path to a file in the media folder"""
+        registry_file = os.path.join(temp_dir, "test_registry.json")
+        processor = MediaProcessor(registry_file)
+        
+        expected = os.path.join(temp_dir, "events", "test.png")
+        assert processor.get_media_path("events/test.png") == expected
+        assert processor.get_media_path("test.png") == expected
     
     def test_process_media_file_image_success(self, temp_dir):
         """Test successful image processing"""
@@ -44,6 +56,72 @@ class TestMediaProcessor:
         assert relative_path == expected_path
         assert os.path.exists(os.path.join(temp_dir, "events", "test.jpg"))
     
+    def test_stale_partial_uploads_removed(self, temp_dir):
+        """Test that old partial uploads are swept while recent ones are kept"""
+        media_dir = os.path.join(temp_dir, "events")
+        os.makedirs(media_dir)
+        stale = os.path.join(media_dir, ".upload-abc.partial.jpg")
+        recent = os.path.join(media_dir, ".upload-def.partial.webp")
+        kept = os.path.join(media_dir, "photo.jpg")
+        for path in (stale, recent, kept):
+            with open(path, "w") as f:
+                f.write("data")
+        os.utime(stale, (0, 0))
+        os.utime(kept, (0, 0))
+        
+        MediaProcessor(os.path.join(temp_dir, "test_registry.json"))
+        
+        assert not os.path.exists(stale)
+        assert os.path.exists(recent)
+        assert os.path.exists(kept)
+    
+    def test_process_media_files_batch(self, temp_dir):
+        """Test processing a batch of files, including same-named files and an unsupported one"""
+        from media_processor.registry import MediaRegistry
+        
+        paths = []
+        for folder in ("a", "b"):
+            os.makedirs(os.path.join(temp_dir, folder))
+            path = os.path.join(temp_dir, folder, "photo.jpg")
+            Image.fromarray(np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)).save(path)
+            paths.append(path)
+        unsupported = os.path.join(temp_dir, "notes.txt")
+        with open(unsupported, "w") as f:
+            f.write("not media")
+        paths.append(unsupported)
+        
+        registry_file = os.path.join(temp_dir, "test_registry.json")
+        processor = MediaProcessor(registry_file)
+        results = processor.process_media_files(paths, MediaRegistry(registry_file))
+        
+        assert results == [
+            ("events/photo.jpg", None),
+            ("events/photo-1.jpg", None),
+            (None, "Unsupported file type"),
+        ]
+        assert os.path.exists(os.path.join(temp_dir, "events", "photo.jpg"))
+        assert os.path.exists(os.path.join(temp_dir, "events", "photo-1.jpg"))
+    
+    def test_process_media_file_partial_upload(self, temp_dir):
+        """Test processing a partial upload under its original filename"""
+        registry_file = os.path.join(temp_dir, "test_registry.json")
+        processor = MediaProcessor(registry_file)
+        
+        upload_path = processor.create_upload_path("photo.JPG")
+        assert os.path.dirname(upload_path) == processor.upload_folder
+        assert os.path.basename(upload_path).startswith('.upload-')
+        assert upload_path.endswith('.partial.jpg')
+        assert upload_path != processor.create_upload_path("photo.JPG")
+        
+        img_array = np.random.randint(0, 255, (100, 150, 3), dtype=np.uint8)
+        Image.fromarray(img_array).save(upload_path, 'JPEG')
+        
+        relative_path, error = processor.process_media_file(upload_path, None, "photo.jpg")
+        
+        assert error is None
+        assert relative_path == "events/photo.jpg"
+        assert os.path.exists(os.path.join(temp_dir, "events", "photo.jpg"))
+    
     def test_process_media_file_image_format_conversion(self, temp_dir):
         """Test image processing with format conversion"""
         # Create test image in unsupported format
@@ -268,6 +346,61 @@ class TestMediaProcessor:
         assert info['audio_codec'] == 'aac'
         assert info['bitrate'] == 1000000
     
+    def test_get_cached_processing_info(self, temp_dir):
+        """Test that processing info is reused until the file changes"""
+        registry_file = os.path.join(temp_dir, "test_registry.json")
+        processor = MediaProcessor(registry_file)
+        
+        img_path = os.path.join(temp_dir, "cached.png")
+        Image.new('RGB', (150, 100)).save(img_path)
+        
+        with patch('media_processor.media_processor.ImageProcessor.get_image_info',
+                   wraps=ImageProcessor.get_image_info) as mock_info:
+            first = processor.get_cached_processing_info(img_path)
+            second = processor.get_cached_processing_info(img_path)
+            assert mock_info.call_count == 1
+            assert first == second
+            assert first['width'] == 150
+            
+            # Rewriting the file invalidates the cached result
+            Image.new('RGB', (300, 200)).save(img_path)
+            os.utime(img_path, ns=(0, 0))
+            third = processor.get_cached_processing_info(img_path)
+            assert mock_info.call_count == 2
+            assert third['width'] == 300
+    
+    def test_get_processing_info_batch(self, temp_dir):
+        """Test batch processing info from scandir entries and plain paths"""
+        registry_file = os.path.join(temp_dir, "test_registry.json")
+        processor = MediaProcessor(registry_file)
+        
+        folder = os.path.join(temp_dir, "batch")
+        os.makedirs(folder)
+        for name, size in (("a.png", (150, 100)), ("b.jpg", (80, 60))):
+            Image.new('RGB', size).save(os.path.join(folder, name))
+        
+        with os.scandir(folder) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        infos = processor.get_processing_info_batch(entries)
+        
+        a_path, b_path = (os.path.join(folder, name) for name in ("a.png", "b.jpg"))
+        assert set(infos) == {a_path, b_path}
+        assert infos[a_path]['width'] == 150
+        assert infos[b_path]['file_type'] == 'image'
+        assert infos[a_path]['original_size'] == processor.get_processing_info(a_path)['original_size']
+        assert processor.get_processing_info_batch([b_path]) == {b_path: infos[b_path]}
+        
+        # A symlinked entry reports its target's size, the same as its plain path
+        link_path = os.path.join(folder, "link.png")
+        try:
+            os.symlink(a_path, link_path)
+        except (OSError, NotImplementedError):
+            return  # Symlinks need extra privileges on Windows
+        with os.scandir(folder) as it:
+            link_entry = next(entry for entry in it if entry.name == "link.png")
+        assert processor.get_processing_info_batch([link_entry]) == processor.get_processing_info_batch([link_path])
+        assert processor.get_processing_info_batch([link_entry])[link_path]['original_size'] == infos[a_path]['original_size']
+    
     def test_get_processing_info_unsupported(self, temp_dir):
         """Test getting processing info for unsupported file"""
         # Create unsupported file
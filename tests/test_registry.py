@@ -48,6 +48,42 @@ class TestMediaRegistry:
         result = registry.load()
         assert result == []
     
+    def test_load_reuses_cache_until_file_changes(self, sample_registry_file):
+        """Test that load only re-parses the registry when the file changes"""
+        registry = MediaRegistry(sample_registry_file)
+        
+        first = registry.load()
+        # Mutating the returned list must not affect later loads
+        first.pop()
+        assert len(registry.load()) == 3
+        
+        # An external write to the file should be picked up
+        with open(sample_registry_file, 'w') as f:
+            json.dump([{"path": "media/external.png"}], f)
+        result = registry.load()
+        assert len(result) == 1
+        assert result[0]["path"] == "media/external.png"
+    
+    def test_get_media_by_index_returns_copy(self, sample_registry_file):
+        """Test that modifying a returned entry does not change the registry"""
+        registry = MediaRegistry(sample_registry_file)
+        
+        entry = registry.get_media_by_index(0)
+        entry['width'] = 100
+        
+        assert 'width' not in registry.get_media_by_index(0)
+    
+    def test_get_etag(self, sample_registry_file, temp_dir):
+        """Test that the ETag changes with the registry file and is None when it is missing"""
+        registry = MediaRegistry(sample_registry_file)
+        etag = registry.get_etag()
+        
+        assert etag == registry.get_etag()
+        registry.add_media("media/new.png")
+        assert registry.get_etag() != etag
+        
+        assert MediaRegistry(os.path.join(temp_dir, "missing.json")).get_etag() is None
+    
     def test_save_success(self, temp_dir):
         """Test successful save operation"""
         registry_file = os.path.join(temp_dir, "test_save.json")
@@ -64,6 +100,21 @@ class TestMediaRegistry:
             saved_data = json.load(f)
         assert saved_data == test_data
     
+    def test_save_matches_without_orjson(self, temp_dir):
+        """Test that the registry file is written identically whether or not orjson is installed"""
+        from unittest.mock import patch
+        
+        test_data = [{"path": "media/café.png", "original_hash": "a" * 40}, {"path": "media/test.webm"}]
+        with_orjson = os.path.join(temp_dir, "with_orjson.json")
+        without_orjson = os.path.join(temp_dir, "without_orjson.json")
+        assert MediaRegistry(with_orjson).save(test_data) is True
+        with patch('config.ORJSON_AVAILABLE', False):
+            assert MediaRegistry(without_orjson).save(test_data) is True
+            assert MediaRegistry(with_orjson).load() == test_data
+        
+        with open(with_orjson, 'rb') as f1, open(without_orjson, 'rb') as f2:
+            assert f1.read() == f2.read()
+    
     def test_save_failure(self, temp_dir):
         """Test save operation failure"""
         # Create a directory with the same name as the file to cause write error
@@ -174,6 +225,30 @@ class TestMediaRegistry:
         assert remaining[0]['path'] == "media/test3.webm"  # Most recent
         assert remaining[1]['path'] == "media/test1.jpg"   # Oldest
     
+    def test_remove_media_by_index_updates_duplicate_lookup(self, temp_dir):
+        """Test that duplicate lookups stay correct after entries are removed"""
+        registry_file = os.path.join(temp_dir, "test_remove_hashes.json")
+        registry = MediaRegistry(registry_file)
+        
+        registry.add_media("media/old_copy.jpg", "a" * 40)
+        registry.add_media("media/other.png", "b" * 40)
+        registry.add_media("media/legacy.png", "c" * 32)
+        registry.add_media("media/new_copy.jpg", "a" * 40)
+        
+        assert registry.remove_media_by_index(0) is True
+        assert registry.find_duplicate_with_index("a" * 40) == ({"path": "media/old_copy.jpg", "original_hash": "a" * 40}, 2)
+        assert registry.find_duplicate_with_index("b" * 40)[1] == 1
+        
+        assert registry.remove_media_by_index(0) is True
+        assert not registry.has_legacy_hashes()
+        assert registry.find_duplicate_with_index("c" * 32) == (None, -1)
+        assert registry.find_duplicate_with_index("b" * 40)[1] == 0
+        
+        # The file on disk matches the cached state and no temporary file is left behind
+        with open(registry_file) as f:
+            assert [entry['path'] for entry in json.load(f)] == ["media/other.png", "media/old_copy.jpg"]
+        assert not os.path.exists(registry_file + '.tmp')
+    
     def test_remove_media_by_index_invalid(self, temp_dir):
         """Test removing media with invalid index"""
         registry_file = os.path.join(temp_dir, "test_remove_invalid.json")
@@ -294,6 +369,58 @@ class TestMediaRegistry:
         no_duplicate = registry.find_duplicate_by_hash("nonexistent")
         assert no_duplicate is None
     
+    def test_migrate_legacy_hash(self, temp_dir):
+        """Test that a legacy hash is replaced on the entry that carries it"""
+        registry = MediaRegistry(os.path.join(temp_dir, "test_migrate.json"))
+        
+        registry.add_media("media/legacy.jpg", "c" * 32)
+        registry.add_media("media/other.jpg", "b" * 40)
+        
+        entry, index = registry.migrate_legacy_hash("c" * 32, "a" * 40)
+        assert (entry, index) == ({"path": "media/legacy.jpg", "original_hash": "a" * 40}, 1)
+        assert registry.get_media_by_index(0) == {"path": "media/other.jpg", "original_hash": "b" * 40}
+        assert registry.find_duplicate_with_index("a" * 40)[1] == 1
+        assert not registry.has_legacy_hashes()
+        
+        assert registry.migrate_legacy_hash("c" * 32, "d" * 40) == (None, -1)
+    
+    def test_find_duplicate_with_index(self, temp_dir):
+        """Test finding duplicates returns the entry and its index"""
+        registry_file = os.path.join(temp_dir, "test_duplicate_index.json")
+        registry = MediaRegistry(registry_file)
+        
+        registry.add_media("file1.jpg", "hash1")
+        registry.add_media("file2.jpg", "hash2")
+        registry.add_media("file3.jpg", "hash3")
+        
+        entry, index = registry.find_duplicate_with_index("hash2")
+        assert entry['path'] == "file2.jpg"
+        assert index == 1
+        
+        # Index should stay correct after removing an earlier entry
+        registry.remove_media_by_index(0)
+        entry, index = registry.find_duplicate_with_index("hash1")
+        assert entry['path'] == "file1.jpg"
+        assert index == 1
+        
+        assert registry.find_duplicate_with_index("nonexistent") == (None, -1)
+    
+    def test_hash_index_matches_fresh_load_after_changes(self, temp_dir):
+        """Test that the incrementally maintained hash index matches one built from the file"""
+        registry_file = os.path.join(temp_dir, "test_hash_index.json")
+        registry = MediaRegistry(registry_file)
+        
+        registry.add_media("file1.jpg", "a" * 32)
+        registry.add_media("file2.jpg", "b" * 40)
+        registry.add_media("file3.jpg")
+        registry.add_media("file4.jpg", "a" * 32)
+        registry.remove_media_by_index(1)
+        
+        fresh = MediaRegistry(registry_file)
+        fresh.load()
+        assert registry._hash_to_index == fresh._hash_to_index == {"a" * 32: 0, "b" * 40: 1}
+        assert registry._legacy_hash_count == fresh._legacy_hash_count == 2
+    
     def test_find_filename_collision(self, temp_dir):
         """Test filename collision detection"""
         registry_file = os.path.join(temp_dir, "test_collision.json")
@@ -310,6 +437,30 @@ class TestMediaRegistry:
         assert registry.find_filename_collision("file3.webm") is True
         assert registry.find_filename_collision("nonexistent.jpg") is False
     
+    def test_filename_collision_tracks_changes(self, temp_dir):
+        """Test that filename collision checks follow adds, removals and external edits"""
+        registry_file = os.path.join(temp_dir, "test_collision_cache.json")
+        registry = MediaRegistry(registry_file)
+        registry.add_media("media/a.jpg")
+        registry.add_media("media/a.jpg")
+        assert registry.find_filename_collision("a.jpg") is True
+        
+        registry.add_media("media/b.png")
+        assert registry.find_filename_collision("b.png") is True
+        
+        # Removing one of two entries with the same filename keeps the collision
+        registry.remove_media_by_index(1)
+        assert registry.find_filename_collision("a.jpg") is True
+        registry.remove_media_by_index(1)
+        assert registry.find_filename_collision("a.jpg") is False
+        
+        # Another process rewrites the file
+        with open(registry_file, 'w') as f:
+            json.dump([{"path": "media/c.webm"}], f)
+        os.utime(registry_file, ns=(0, 0))
+        assert registry.find_filename_collision("c.webm") is True
+        assert registry.find_filename_collision("b.png") is False
+    
     def test_get_unique_filename(self, temp_dir):
         """Test unique filename generation"""
         registry_file = os.path.join(temp_dir, "test_unique.json")
@@ -328,6 +479,27 @@ class TestMediaRegistry:
         # Test with different extensions
         registry.add_media("media/image.png")
         assert registry.get_unique_filename("image.png") == "image-1.png"
+        
+        # Reserved names are skipped as if they were already registered
+        assert registry.get_unique_filename("newfile.jpg", {"newfile.jpg"}) == "newfile-1.jpg"
+        assert registry.get_unique_filename("test.jpg", {"test-3.jpg"}) == "test-4.jpg"
+    
+    def test_reserve_unique_filename(self, temp_dir):
+        """Test that reserved names stay taken until added to the registry or released"""
+        registry = MediaRegistry(os.path.join(temp_dir, "test_reserve.json"))
+        
+        assert registry.reserve_unique_filename("image.jpg") == "image.jpg"
+        assert registry.reserve_unique_filename("image.jpg") == "image-1.jpg"
+        assert registry.get_unique_filename("image.jpg") == "image-2.jpg"
+        
+        # A failed conversion frees its name
+        registry.release_filename("image-1.jpg")
+        assert registry.get_unique_filename("image.jpg") == "image-1.jpg"
+        
+        # Registering the name replaces the reservation
+        registry.add_media("media/image.jpg")
+        assert "image.jpg" not in registry._in_flight
+        assert registry.get_unique_filename("image.jpg") == "image-1.jpg"
     
     def test_save_registry_with_filename_only(self, temp_dir):
         """Test saving registry when registry_file is just a filename"""
@@ -35,6 +35,11 @@ class TestTagDependencyManager:
         variables = self.manager._extract_variables_from_condition(condition)
         assert variables == ["action"]
         
+        # Test quotes of the other style inside string literals
+        condition = """mood == 'say "hi"' && style == "it's" and NOT level"""
+        variables = self.manager._extract_variables_from_condition(condition)
+        assert variables == ["mood", "style", "level"]
+        
         # Test empty condition
         variables = self.manager._extract_variables_from_condition("")
         assert variables == []
@@ -144,6 +149,37 @@ class TestTagDependencyManager:
         expected_order = ['participants', 'girls', 'guys', 'action', 'dance_style', 'scene']
         assert ordered == expected_order
     
+    def test_get_ordered_tags_keeps_original_order_of_ready_tags(self):
+        """Test that tags are only moved as far as their dependencies require"""
+        config = {
+            'tags': {
+                'a': {},
+                'b': {'req': 'a > 0'},
+                'c': {'req': 'b > 0'},
+                'd': {'req': 'b > 0'},
+                'e': {'req': 'c > 0 && d > 0'}
+            }
+        }
+        self.manager.analyze_dependencies(config)
+        
+        ordered = self.manager.get_ordered_tags(['c', 'b', 'd', 'a', 'e'])
+        assert ordered == ['a', 'b', 'c', 'd', 'e']
+    
+    def test_get_ordered_tags_with_cycle(self):
+        """Test that ordering terminates and keeps every tag when dependencies are circular"""
+        config = {
+            'tags': {
+                'tag1': {'req': 'tag2'},
+                'tag2': {'req': 'tag1'},
+                'tag3': {},
+                'tag4': {'req': 'tag3'}
+            }
+        }
+        self.manager.analyze_dependencies(config)
+        
+        ordered = self.manager.get_ordered_tags(['tag4', 'tag1', 'tag2', 'tag3'])
+        assert ordered == ['tag3', 'tag4', 'tag1', 'tag2']
+    
     def test_detect_circular_dependencies(self):
         """Test circular dependency detection"""
         # Set up circular dependencies
@@ -160,6 +196,19 @@ class TestTagDependencyManager:
         assert len(cycles) > 0
         assert any('tag1' in cycle and 'tag2' in cycle and 'tag3' in cycle for cycle in cycles)
     
+    def test_detect_circular_dependencies_deep_chain(self):
+        """Test cycle detection on a dependency chain deeper than Python's recursion limit"""
+        depth = 5000
+        self.manager.tag_dependencies = {f'tag{i}': {f'tag{i + 1}'} for i in range(depth)}
+        assert self.manager.detect_circular_dependencies() == []
+        
+        # Close the chain into a loop
+        self.manager.tag_dependencies[f'tag{depth}'] = {'tag0'}
+        cycles = self.manager.detect_circular_dependencies()
+        assert len(cycles) == 1
+        assert cycles[0][0] == cycles[0][-1] == 'tag0'
+        assert len(cycles[0]) == depth + 2
+    
     def test_no_circular_dependencies(self):
         """Test that no cycles are detected in valid configuration"""
         config = {
@@ -174,6 +223,23 @@ class TestTagDependencyManager:
         cycles = self.manager.detect_circular_dependencies()
         assert cycles == []
     
+    def test_reanalysis_publishes_dependencies_at_once(self):
+        """Test that the previous dependency map stays visible until a new analysis finishes"""
+        self.manager.analyze_dependencies({'tags': {'a': {}, 'b': {'req': 'a > 0'}}})
+        previous = self.manager.tag_dependencies
+        seen_during_analysis = []
+        
+        extract = self.manager._extract_variables_from_condition
+        def spy(condition):
+            seen_during_analysis.append(self.manager.tag_dependencies)
+            return extract(condition)
+        self.manager._extract_variables_from_condition = spy
+        
+        self.manager.analyze_dependencies({'tags': {'a': {}, 'b': {'req': 'a > 0'}, 'c': {'req': 'b > 0'}}})
+        
+        assert seen_during_analysis and all(deps is previous for deps in seen_during_analysis)
+        assert self.manager.tag_dependencies['c'] == frozenset({'b'})
+    
     def test_empty_config(self):
         """Test handling of empty configuration"""
         config = {}
@@ -7,6 +7,7 @@ import json
 import os
 import tempfile
 import yaml
+from unittest.mock import patch
 from tagging.tag_registry import TagRegistry
 
 
@@ -58,6 +59,17 @@ class TestTagRegistry:
         loaded_data = tag_registry.load_registry()
         assert loaded_data == test_data
     
+    def test_get_shares_instance_per_path(self, temp_dir):
+        """Test that TagRegistry.get returns one shared instance per registry path"""
+        first_path = os.path.join(temp_dir, "first", "events_registry.json")
+        second_path = os.path.join(temp_dir, "second", "events_registry.json")
+        
+        first = TagRegistry.get(first_path)
+        assert TagRegistry.get(first_path) is first
+        assert TagRegistry.get(os.path.join(temp_dir, "first", ".", "events_registry.json")) is first
+        assert TagRegistry.get(second_path) is not first
+        assert TagRegistry.get(second_path).media_registry_path == second_path
+    
     def test_get_and_set_media_tags(self, temp_dir):
         """Test getting and setting media tags"""
         media_registry_path = os.path.join(temp_dir, "events_registry.json")
@@ -82,6 +94,121 @@ class TestTagRegistry:
         media_tags = tag_registry.get_media_tags('events/test.jpg')
         assert media_tags == tags
     
+    def test_media_tags_reuse_parsed_registry(self, temp_dir):
+        """Test that lookups reuse the parsed registry until the file changes"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        tag_registry = TagRegistry(media_registry_path)
+        tag_registry.save_registry([{'path': 'events/test.jpg', 'tags': {'tag1': 'value1'}}])
+        
+        with patch('tagging.tag_registry.load_json_file') as mock_load:
+            assert tag_registry.get_media_tags('events/test.jpg') == {'tag1': 'value1'}
+            assert tag_registry.get_media_tags_old() == {'events/test.jpg': {'tag1': 'value1'}}
+            mock_load.assert_not_called()
+        
+        # A write from outside this instance (e.g. the media registry) is picked up
+        with open(media_registry_path, 'w') as f:
+            json.dump([{'path': 'events/test.jpg', 'tags': {'tag1': 'changed', 'tag2': 'added'}}], f)
+        assert tag_registry.get_media_tags('events/test.jpg') == {'tag1': 'changed', 'tag2': 'added'}
+    
+    def test_cached_tags_are_not_shared_with_callers(self, temp_dir):
+        """Test that modifying returned or saved tags leaves later lookups unchanged"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        tag_registry = TagRegistry(media_registry_path)
+        registry_data = [{'path': 'events/test.jpg', 'tags': {'tag1': 'value1'}}]
+        tag_registry.save_registry(registry_data)
+        
+        registry_data[0]['tags']['tag1'] = 'changed'
+        tag_registry.get_media_tags('events/test.jpg')['tag2'] = 'added'
+        tag_registry.get_media_tags_old()['events/test.jpg']['tag3'] = 'added'
+        
+        assert tag_registry.get_media_tags('events/test.jpg') == {'tag1': 'value1'}
+    
+    def test_set_media_tags_updates_first_matching_entry(self, temp_dir):
+        """Test that tags are read from and written to the first entry for a path"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        tag_registry = TagRegistry(media_registry_path)
+        tag_registry.save_registry([
+            {'path': 'events/a.jpg', 'tags': {'tag1': 'a'}},
+            {'path': 'events/b.jpg', 'tags': {'tag1': 'first'}},
+            {'path': 'events/b.jpg', 'tags': {'tag1': 'second'}},
+        ])
+        
+        assert tag_registry.get_media_tags('events/b.jpg') == {'tag1': 'first'}
+        assert tag_registry.set_media_tags('events/b.jpg', {'tag1': 'updated'}) is True
+        
+        registry_data = tag_registry.load_registry()
+        assert [entry['tags']['tag1'] for entry in registry_data] == ['a', 'updated', 'second']
+    
+    def test_set_media_tags_batch(self, temp_dir):
+        """Test setting tags for several media files with a single registry write"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        tag_registry = TagRegistry(media_registry_path)
+        tag_registry.save_registry([{'path': 'events/a.jpg', 'tags': {}}])
+        
+        with patch.object(tag_registry, 'save_registry', wraps=tag_registry.save_registry) as mock_save:
+            success = tag_registry.set_media_tags_batch({
+                'events/a.jpg': {'tag1': 'a'},
+                'events/b.jpg': {'tag1': 'b'},
+            })
+        
+        assert success is True
+        mock_save.assert_called_once()
+        registry_data = tag_registry.load_registry()
+        assert [entry['path'] for entry in registry_data] == ['events/a.jpg', 'events/b.jpg']
+        assert tag_registry.get_media_tags('events/a.jpg') == {'tag1': 'a'}
+        assert tag_registry.get_media_tags('events/b.jpg') == {'tag1': 'b'}
+    
+    def test_save_registry_is_atomic(self, temp_dir):
+        """Test that a failed save leaves the previous registry file intact"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        tag_registry = TagRegistry(media_registry_path)
+        original = [{'path': 'events/test.jpg', 'tags': {'tag1': 'value1'}}]
+        assert tag_registry.save_registry(original) is True
+        
+        with patch('media_processor.registry.os.replace', side_effect=OSError("disk full")):
+            assert tag_registry.save_registry([{'path': 'events/other.jpg', 'tags': {}}]) is False
+        
+        assert TagRegistry(media_registry_path).load_registry() == original
+        assert os.listdir(temp_dir) == ["events_registry.json"]
+    
+    def test_registry_parse_waits_for_writers(self, temp_dir):
+        """Test that re-reading a changed registry waits while another thread holds the registry lock"""
+        import threading
+        
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        tag_registry = TagRegistry(media_registry_path)
+        with open(media_registry_path, 'w') as f:
+            json.dump([{'path': 'events/test.jpg', 'tags': {'tag1': 'value1'}}], f)
+        
+        results = []
+        reader = threading.Thread(target=lambda: results.append(tag_registry.get_media_tags('events/test.jpg')))
+        with tag_registry._write_lock:
+            reader.start()
+            reader.join(timeout=0.2)
+            assert reader.is_alive() and not results
+        reader.join(timeout=10)
+        
+        assert results == [{'tag1': 'value1'}]
+    
+    def test_tag_saves_and_media_adds_do_not_overwrite_each_other(self, temp_dir):
+        """Test that concurrent tag saves and media additions to the same file all survive"""
+        from concurrent.futures import ThreadPoolExecutor
+        from media_processor.registry import MediaRegistry
+        
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        media_registry = MediaRegistry(media_registry_path)
+        tag_registry = TagRegistry(media_registry_path)
+        assert tag_registry._write_lock is media_registry._lock
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(media_registry.add_media, f'events/added{i}.jpg') for i in range(20)]
+            futures += [executor.submit(tag_registry.set_media_tags, f'events/tagged{i}.jpg', {'n': i})
+                        for i in range(20)]
+            assert all(future.result() for future in futures)
+        
+        paths = {entry['path'] for entry in tag_registry.load_registry()}
+        assert paths == {f'events/added{i}.jpg' for i in range(20)} | {f'events/tagged{i}.jpg' for i in range(20)}
+    
     def test_get_media_tags_for_nonexistent_file(self, temp_dir):
         """Test getting tags for a file that doesn't have any"""
         media_registry_path = os.path.join(temp_dir, "events_registry.json")
@@ -145,6 +272,41 @@ class TestTagRegistry:
         assert config['tags']['girls']['desc'] == 'Number of girls in the scene.'
         assert config['tags']['dance_style']['req'] == 'girls > 0 || guys > 0'
     
+    def test_tag_config_parsed_once_until_changed(self, temp_dir):
+        """Test that the YAML tag configuration is only re-parsed when the file changes"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        tag_registry = TagRegistry(media_registry_path)
+        yaml_path = os.path.join(temp_dir, "events_tags.yaml")
+        with open(yaml_path, 'w') as f:
+            yaml.dump({'tags': {'girls': {'type': 'int'}}}, f)
+        
+        with patch('tagging.tag_registry.yaml.load', wraps=yaml.load) as mock_load:
+            assert tag_registry.get_tag_config()['tag_order'] == ['girls']
+            assert tag_registry._convert_tag_types({'girls': '2', 'other': '3'}) == {'girls': 2, 'other': '3'}
+            assert tag_registry.get_tag_config()['tag_order'] == ['girls']
+            assert mock_load.call_count == 1
+            
+            with open(yaml_path, 'w') as f:
+                yaml.dump({'tags': {'girls': {'type': 'int'}, 'guys': {'type': 'int'}}}, f)
+            assert tag_registry.get_tag_config()['tag_order'] == ['girls', 'guys']
+            assert tag_registry._convert_tag_types({'guys': '1'}) == {'guys': 1}
+            assert mock_load.call_count == 2
+        
+        # Changing the returned config leaves the cached copy intact
+        tag_registry.get_tag_config()['tags']['girls']['type'] = 'string'
+        assert tag_registry.get_tag_config()['tags']['girls']['type'] == 'int'
+    
+    def test_tag_config_loads_without_libyaml(self, temp_dir):
+        """Test that the pure-Python YAML loader reads the same configuration"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        yaml_path = os.path.join(temp_dir, "events_tags.yaml")
+        with open(yaml_path, 'w') as f:
+            yaml.dump({'tags': {'girls': {'type': 'int', 'values': ['0', '1', 'many']}}}, f)
+        
+        config = TagRegistry(media_registry_path).get_tag_config()
+        with patch('tagging.tag_registry.YamlSafeLoader', yaml.SafeLoader):
+            assert TagRegistry(media_registry_path).get_tag_config() == config
+    
     def test_get_tag_config_nonexistent_file(self, temp_dir):
         """Test loading tag configuration when YAML file doesn't exist"""
         media_registry_path = os.path.join(temp_dir, "events_registry.json")
@@ -198,6 +360,15 @@ class TestTagRegistry:
         assert loaded_data[0]['tags'] == {}
         assert loaded_data[1]['tags'] == {'existing': 'tag'}
     
+    def test_load_registry_invalid_json(self, temp_dir):
+        """Test that an unreadable registry file loads as empty"""
+        media_registry_path = os.path.join(temp_dir, "events_registry.json")
+        with open(media_registry_path, 'wb') as f:
+            f.write(b'[{"path": ')
+        tag_registry = TagRegistry(media_registry_path)
+        
+        assert tag_registry.load_registry() == []
+    
     def test_tag_type_conversion(self, temp_dir):
         """Test that tag values are converted to appropriate types based on configuration"""
         media_registry_path = os.path.join(temp_dir, "events_registry.json")
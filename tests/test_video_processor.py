@@ -4,7 +4,9 @@ Tests for video processor module
 
 import pytest
 import os
-from unittest.mock import MagicMock
+import sys
+import types
+from unittest.mock import MagicMock, patch
 from media_processor.video_processor import VideoProcessor
 
 
@@ -75,7 +77,7 @@ class TestVideoProcessor:
         result = VideoProcessor.resize_video(input_path, output_path)
         
         assert result is True
-        mock_ffmpeg_probe.assert_called_once_with(input_path)
+        mock_ffmpeg_probe.assert_called_once_with(input_path, select_streams='v:0')
         mock_ffmpeg_stream['input'].assert_called_once_with(input_path)
         mock_ffmpeg_stream['run'].assert_called_once()
     
@@ -92,10 +94,74 @@ class TestVideoProcessor:
         result = VideoProcessor.resize_video(input_path, output_path)
         
         assert result is True
-        mock_ffmpeg_probe.assert_called_once_with(input_path)
+        mock_ffmpeg_probe.assert_called_once_with(input_path, select_streams='v:0')
         mock_ffmpeg_stream['input'].assert_called_once_with(input_path)
         mock_ffmpeg_stream['run'].assert_called_once()
     
+    def test_resize_video_hwaccel(self, temp_dir, mock_ffmpeg_probe, mock_ffmpeg_stream):
+        """Test that a configured hardware decoder is passed to ffmpeg's input"""
+        input_path = os.path.join(temp_dir, "input.mkv")
+        output_path = os.path.join(temp_dir, "output.webm")
+        with open(input_path, 'w') as f:
+            f.write("dummy video content")
+        
+        with patch('media_processor.video_processor.DECODE_PARAMS', {'hwaccel': 'cuda'}):
+            result = VideoProcessor.resize_video(input_path, output_path)
+        
+        assert result is True
+        mock_ffmpeg_stream['input'].assert_called_once_with(input_path, hwaccel='cuda')
+        assert mock_ffmpeg_stream['output'].call_args[1]['vf'] == 'scale=1024:576'
+    
+    def test_resize_video_scales_on_gpu(self, temp_dir, mock_ffmpeg_probe, mock_ffmpeg_stream):
+        """Test that frames kept on the GPU are scaled there before being downloaded"""
+        input_path = os.path.join(temp_dir, "input.mkv")
+        output_path = os.path.join(temp_dir, "output.webm")
+        with open(input_path, 'w') as f:
+            f.write("dummy video content")
+        
+        decode_params = {'hwaccel': 'cuda', 'hwaccel_output_format': 'cuda'}
+        with patch('media_processor.video_processor.DECODE_PARAMS', decode_params):
+            result = VideoProcessor.resize_video(input_path, output_path)
+        
+        assert result is True
+        mock_ffmpeg_stream['input'].assert_called_once_with(input_path, **decode_params)
+        vf = mock_ffmpeg_stream['output'].call_args[1]['vf']
+        assert vf == 'scale_cuda=1024:576:format=yuv420p,hwdownload,format=yuv420p'
+    
+    def test_resize_video_copies_conforming_stream(self, temp_dir, mock_ffmpeg_probe, mock_ffmpeg_stream):
+        """Test that a VP9 source already at the target size is not re-encoded"""
+        input_path = os.path.join(temp_dir, "input.webm")
+        output_path = os.path.join(temp_dir, "output.webm")
+        with open(input_path, 'w') as f:
+            f.write("dummy video content")
+        mock_ffmpeg_probe.return_value = {
+            'streams': [{'codec_type': 'video', 'width': 1024, 'height': 576, 'codec_name': 'vp9'}]
+        }
+        
+        result = VideoProcessor.resize_video(input_path, output_path)
+        
+        assert result is True
+        mock_ffmpeg_stream['input'].assert_called_once_with(input_path)
+        output_kwargs = mock_ffmpeg_stream['output'].call_args[1]
+        assert output_kwargs == {'vcodec': 'copy', 'acodec': 'libopus'}
+    
+    def test_resize_video_reencodes_other_codec(self, temp_dir, mock_ffmpeg_probe, mock_ffmpeg_stream):
+        """Test that a source at the target size but in another codec is still encoded"""
+        input_path = os.path.join(temp_dir, "input.mp4")
+        output_path = os.path.join(temp_dir, "output.webm")
+        with open(input_path, 'w') as f:
+            f.write("dummy video content")
+        mock_ffmpeg_probe.return_value = {
+            'streams': [{'codec_type': 'video', 'width': 1024, 'height': 576, 'codec_name': 'h264'}]
+        }
+        
+        result = VideoProcessor.resize_video(input_path, output_path)
+        
+        assert result is True
+        output_kwargs = mock_ffmpeg_stream['output'].call_args[1]
+        assert output_kwargs['vcodec'] == 'libvpx-vp9'
+        assert output_kwargs['vf'] == 'scale=1024:576'
+    
     def test_resize_video_default_format(self, temp_dir, mock_ffmpeg_probe, mock_ffmpeg_stream):
         """Test video resizing with default format"""
         input_path = os.path.join(temp_dir, "input.mov")
@@ -109,10 +175,53 @@ class TestVideoProcessor:
         result = VideoProcessor.resize_video(input_path, output_path)
         
         assert result is True
-        mock_ffmpeg_probe.assert_called_once_with(input_path)
+        mock_ffmpeg_probe.assert_called_once_with(input_path, select_streams='v:0')
         mock_ffmpeg_stream['input'].assert_called_once_with(input_path)
         mock_ffmpeg_stream['run'].assert_called_once()
     
+    def test_resize_video_animated_webp(self, temp_dir, mock_ffmpeg_probe, mock_ffmpeg_stream):
+        """Test that an animated WebP is scaled from the Wand intermediate straight into the output"""
+        input_path = os.path.join(temp_dir, "input.webp")
+        output_path = os.path.join(temp_dir, "output.webm")
+        converted_path = os.path.join(temp_dir, "output.temp.webm")
+        with open(input_path, 'w') as f:
+            f.write("dummy webp content")
+        
+        def fake_convert(webp_path, webm_path):
+            with open(webm_path, 'w') as f:
+                f.write("converted")
+            return True
+        
+        with patch.object(VideoProcessor, 'convert_webp_to_webm', side_effect=fake_convert):
+            result = VideoProcessor.resize_video(input_path, output_path)
+        
+        assert result is True
+        mock_ffmpeg_probe.assert_called_once_with(converted_path, select_streams='v:0')
+        mock_ffmpeg_stream['input'].assert_called_once_with(converted_path)
+        assert mock_ffmpeg_stream['output'].call_args[0][1] == output_path
+        assert not os.path.exists(converted_path)
+    
+    def test_resize_video_animated_webp_keeps_conversion(self, temp_dir, mock_ffmpeg_probe):
+        """Test that the unscaled Wand conversion is kept if FFmpeg can't resize it"""
+        mock_ffmpeg_probe.side_effect = Exception("FFmpeg error")
+        input_path = os.path.join(temp_dir, "input.webp")
+        output_path = os.path.join(temp_dir, "output.webm")
+        with open(input_path, 'w') as f:
+            f.write("dummy webp content")
+        
+        def fake_convert(webp_path, webm_path):
+            with open(webm_path, 'w') as f:
+                f.write("converted")
+            return True
+        
+        with patch.object(VideoProcessor, 'convert_webp_to_webm', side_effect=fake_convert):
+            result = VideoProcessor.resize_video(input_path, output_path)
+        
+        assert result is True
+        with open(output_path) as f:
+            assert f.read() == "converted"
+        assert not os.path.exists(os.path.join(temp_dir, "output.temp.webm"))
+    
     def test_resize_video_failure(self, temp_dir, mock_ffmpeg_probe):
         """Test video resizing failure"""
         # Mock ffmpeg.probe to raise an exception
@@ -212,7 +321,9 @@ class TestVideoProcessor:
             mock_wand_class.return_value.__enter__ = MagicMock(return_value=mock_context)
             mock_wand_class.return_value.__exit__ = MagicMock(return_value=None)
             
-            m.setattr('media_processor.video_processor.WandImage', mock_wand_class)
+            # Wand is imported inside convert_webp_to_webm, so provide it through sys.modules
+            m.setitem(sys.modules, 'wand', types.ModuleType('wand'))
+            m.setitem(sys.modules, 'wand.image', types.SimpleNamespace(Image=mock_wand_class))
             m.setattr('media_processor.video_processor.WAND_AVAILABLE', True)
             
             result = VideoProcessor.convert_webp_to_webm(input_path, output_path)